@@ -0,0 +1,236 @@
+import sys
+import json
+import time
+import random
+
+import tradingDefs
+from tradingDefs import *
+
+possibleCurrencyPairs = ["EURUSD", "USDJPY", "GBPUSD", "AUDUSD",
+                         "USDCAD", "EURJPY", "EURGBP", "GBPJPY",
+                         "AUDJPY", "AUDCAD", "CADJPY"]
+
+importantCurrencies = ["EUR", "USD", "GBP", "AUD", "JPY", "CAD"]
+
+# fixed XX/PLN rates, so the pipeline does not call the NBP API
+exchangeRatesPLN = {"EUR": 4.45, "USD": 3.95, "GBP": 5.05,
+                    "AUD": 2.85, "CAD": 2.95, "JPY": 0.036}
+
+
+class FakeConnection:
+
+    def __init__(self, payload, chunkSize):
+        self.chunks = [payload[index: index + chunkSize]
+                       for index in range(0, len(payload), chunkSize)
+                       ]
+        self.index = 0
+
+    def recv(self, bytesSize):
+        chunk = self.chunks[self.index]
+        self.index += 1
+        return chunk
+
+    def close(self):
+        pass
+
+
+def chart_payload(bars, symbol="EURUSD"):
+    startCtm = 1600000000000
+    rateInfos = []
+    price = 110000
+    for bar in range(bars):
+        price += random.randint(-20, 20)
+        rateInfos.append({"ctm": startCtm + bar * 900000,
+                          "ctmString": "Sep 13, 2020, 12:26:40 PM",
+                          "open": price,
+                          "high": random.randint(0, 30),
+                          "low": -random.randint(0, 30),
+                          "close": random.randint(-20, 20),
+                          "vol": random.randint(100, 3000) * 1.0})
+    response = {"status": True,
+                "returnData": {"digits": 5, "rateInfos": rateInfos, "symbol": symbol}}
+    return (json.dumps(response) + "\n\n").encode("utf-8")
+
+
+def calendar_payload(events):
+    countries = ["US", "EU", "GB", "JP", "AU", "CA", "DE", "FR", "CN", "NZ"]
+    calendar = []
+    for index in range(events):
+        forecast = round(random.uniform(-2, 5), 1)
+        calendar.append({"country": countries[index % len(countries)],
+                         "title": "Retail Sales M/M",
+                         "impact": random.choice(["1", "2", "3"]),
+                         "period": "(Sep)",
+                         "previous": str(round(forecast + random.uniform(-1, 1), 1)),
+                         "forecast": str(forecast),
+                         "current": "",
+                         "time": 1600000000000 + index * 600000})
+    response = {"status": True, "returnData": calendar}
+    return (json.dumps(response) + "\n\n").encode("utf-8")
+
+
+def legacy_read(connection, bytesSize=4096):
+    # JsonSocket._read before the byte-level framing
+    decoder = json.JSONDecoder()
+    receivedData = ''
+    while True:
+        char = connection.recv(bytesSize).decode()
+        receivedData += char
+        try:
+            (resp, size) = decoder.raw_decode(receivedData)
+            break
+        except ValueError:
+            continue
+    return resp
+
+
+def framed_read(connection, bytesSize=4096):
+    jsonSocket = JsonSocket("localhost", 0)
+    jsonSocket.conn = connection
+    resp = jsonSocket._read(bytesSize)
+    jsonSocket.close()
+    return resp
+
+
+def bench_framing(bars=(2000, 10000, 20000), chunkSize=4096, repeats=1):
+    results = {}
+    for barsCount in bars:
+        payload = chart_payload(barsCount)
+        timings = {}
+        for name, reader in (("legacy", legacy_read), ("framed", framed_read)):
+            best = None
+            for _ in range(repeats):
+                connection = FakeConnection(payload, chunkSize)
+                startCounter = time.perf_counter()
+                resp = reader(connection, chunkSize)
+                elapsed = time.perf_counter() - startCounter
+                if best == None or elapsed < best:
+                    best = elapsed
+            assert len(resp["returnData"]["rateInfos"]) == barsCount
+            timings[name] = best
+        megabytes = len(payload) / 1024 / 1024
+        results[barsCount] = timings
+        print("framing %6d bars %6.2f MB: legacy %8.1f MB/s, framed %8.1f MB/s, x%.1f" % (
+            barsCount, megabytes, megabytes / timings["legacy"],
+            megabytes / timings["framed"], timings["legacy"] / timings["framed"]))
+    return results
+
+
+def bench_codecs(repeats=5):
+    codecs = [JsonCodec]
+    if orjson != None:
+        codecs.append(OrjsonCodec)
+    payloads = {"getChartRangeRequest 1824 bars": chart_payload(1824),
+                "getChartRangeRequest 20000 bars": chart_payload(20000),
+                "getCalendar 3000 events": calendar_payload(3000)}
+    results = {}
+    for name, payload in payloads.items():
+        frame = payload[:-2]
+        megabytes = len(frame) / 1024 / 1024
+        for codec in codecs:
+            decodeTime = min(timed(codec.loads, frame)
+                             for _ in range(repeats))
+            decoded = codec.loads(frame)
+            encodeTime = min(timed(codec.dumps, decoded)
+                             for _ in range(repeats))
+            results[(name, codec.name)] = (decodeTime, encodeTime)
+            print("%-32s %-7s decode %7.1f MB/s, encode %7.1f MB/s" % (
+                name, codec.name, megabytes / decodeTime, megabytes / encodeTime))
+    return results
+
+
+def timed(function, argument):
+    startCounter = time.perf_counter()
+    function(argument)
+    return time.perf_counter() - startCounter
+
+
+def run_pipeline(client, pairs=possibleCurrencyPairs, currencies=importantCurrencies):
+    # decision chain of tradingMain.py without trading, mail and exchange rates download
+    currentTrades = CurrentTrades(client)
+    indicatorGraph.begin_cycle(client, pairs)
+    slowStochQuater = indicatorGraph.get("stoch:quater")
+
+    calendarFromApi = Calendar(client, currencies)
+    bullsAndBears = BullsAndBears(calendarFromApi)
+    possibleFullTrades = bullsAndBears.get_possible_trades_both_lists(pairs)
+    possibleSemiTrades = bullsAndBears.get_semi_possible_trades(
+        pairs, currencies)
+    possibleTradesFromCalendar = bullsAndBears.get_trade_directions_for_pairs(
+        pairs)
+
+    indicators = indicatorGraph.evaluate(
+        ["resistance", "support", "stochTrades", "trends"])
+    resistanceDict = indicators["resistance"]
+    supportDict = indicators["support"]
+    possibleTradesFromStoch = indicators["stochTrades"]
+
+    trends = indicators["trends"]
+    possibleTradesFromTrends = trends.check_trades_and_trends(
+        possibleTradesFromCalendar)
+
+    possibleTradesWithOkTrendsAndStoch = {pair: possibleTradesFromStoch[pair]
+                                          for pair in possibleTradesFromTrends
+                                          if pair in possibleTradesFromStoch and
+                                          (possibleTradesFromTrends[pair] == possibleTradesFromStoch[pair] or
+                                           possibleTradesFromTrends[pair] == "both")
+                                          }
+    withoutCurrent = currentTrades.check_current_trades_get_unique(
+        possibleTradesWithOkTrendsAndStoch)
+    shiftedOrderTrades = bullsAndBears.change_trades_order(
+        possibleSemiTrades, possibleFullTrades, withoutCurrent)
+    possibleTradesWithAllOk = bullsAndBears.get_unique_currency_pairs(
+        shiftedOrderTrades)
+
+    accountData = MoneyManagement(client)
+    currencyExchangePLN = {pair: exchangeRatesPLN[pair[0:3]]
+                           for pair in possibleTradesWithAllOk
+                           }
+    positionsParameters = PositionParameters(client, possibleTradesWithAllOk, currencyExchangePLN,
+                                             accountData.equity, resistanceDict, supportDict,
+                                             possibleFullTrades, possibleSemiTrades,
+                                             slowStochQuater.averageHighLowsPerPair)
+    return positionsParameters.tradesToExecute
+
+
+def record_pipeline(path, address="127.0.0.1", port=5124, encrypt=False, userId=0, password=""):
+    # one pipeline run against a live (or mock) server, recorded to path
+    session = APISession(userId, password, address, port,
+                         encrypt, recordPath=path)
+    startCounter = time.perf_counter()
+    run_pipeline(session)
+    print("recorded %s in %.1f s" % (path, time.perf_counter() - startCounter))
+    session.disconnect()
+
+
+def bench_replay(path, repeats=3):
+    # replays the recording at full speed, so only the decision code is measured
+    timings = []
+    # recorded bars must not end up in the on-disk archive
+    candleStore.archive = None
+    for _ in range(repeats):
+        # every repeat starts without cached bars and indicator state, like the recorded run
+        candleStore.clear()
+        tradingDefs.stochRegistry = StochRegistry()
+        session = APISession(0, "", transport=ReplayTransport(path))
+        startCounter = time.perf_counter()
+        startCpu = time.process_time()
+        run_pipeline(session)
+        timings.append((time.perf_counter() - startCounter,
+                        time.process_time() - startCpu))
+        session.disconnect()
+    wall, cpu = min(timings)
+    print("replay %s: wall %.3f s, cpu %.3f s" % (path, wall, cpu))
+    return wall, cpu
+
+
+if __name__ == "__main__":
+    random.seed(0)
+    if len(sys.argv) > 1 and sys.argv[1] == "record":
+        record_pipeline(sys.argv[2], *sys.argv[3:4], *[int(port) for port in sys.argv[4:5]])
+    elif len(sys.argv) > 1 and sys.argv[1] == "replay":
+        bench_replay(sys.argv[2])
+    elif len(sys.argv) > 1 and sys.argv[1] == "codecs":
+        bench_codecs()
+    else:
+        bench_framing()
@@ -3,7 +3,7 @@ import socket
 import logging
 import time
 import ssl
-from threading import Thread
+from threading import Thread, Lock, RLock, Event, Condition
 import os
 from datetime import datetime
 from datetime import timedelta
@@ -12,7 +12,19 @@ import math
 import requests
 import eventlet
 from copy import deepcopy
-from collections import Counter
+from collections import Counter, deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+import queue
+import asyncio
+import itertools
+import numpy as np
+from zoneinfo import ZoneInfo
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 os.chdir(os.path.dirname(__file__))
 
@@ -25,11 +37,86 @@ DEFAULT_XAPI_PORT = 5124
 DEFUALT_XAPI_STREAMING_PORT = 5125
 
 # API inter-command timeout (in ms)
-API_SEND_TIMEOUT = 500
+API_SEND_TIMEOUT = 200
+
+# API burst budget - how many commands can be sent back to back
+API_SEND_BURST = 5
+
+# xAPI message terminator
+API_MESSAGE_END = b'\n\n'
+
+# idle time after which a session sends ping (in s)
+API_PING_INTERVAL = 60
+
+# error codes after which the session logs in again
+API_RELOGIN_ERRORS = ["BE103", "BE104"]
+
+# number of sessions in APIClientPool
+API_POOL_SIZE = 3
+
+# max size of one message read by AsyncAPIClient (in bytes)
+API_ASYNC_READ_LIMIT = 2 ** 27
+
+# quotes older than this are not used by BidAsk (in s)
+QUOTE_MAX_AGE = 5
+
+# how long getAllSymbols metadata is reused (in s)
+SYMBOLS_CACHE_TTL = 3600
+
+# file to which APISession records all commands and responses, None disables recording
+API_RECORD_PATH = None
+
+# max messages waiting in one stream channel
+STREAM_QUEUE_SIZE = 1000
+
+# history kept in memory by CandleStore (in days)
+CANDLE_STORE_DAYS = 21
+
+# bars downloaded less than this ago are served without a request (in s)
+CANDLE_STORE_MAX_AGE = 15
+
+# bars older than CANDLE_STORE_DAYS are kept while a start before them was asked for within this (in s)
+CANDLE_STORE_REQUEST_TTL = 3600
+
+# period from which the other chart time frames are resampled (in min), None downloads each time frame
+CHART_BASE_PERIOD = 15
+
+# time zone to which XTB aligns 4 hour and daily bars, None aligns them to UTC
+CHART_ALIGNMENT_TZ = "Europe/Warsaw"
+
+# M1 bars kept per symbol by CandleBook
+CANDLE_BOOK_SIZE = 3 * 1440
+
+# directory of the on-disk candle archive, None disables it
+CANDLE_ARCHIVE_PATH = "candles"
+
+# how long a response is shared by repeated identical commands within one cycle (in s),
+# commands missing here (trades, transactions, ping) are always sent - getAllSymbols and
+# getChartRangeRequest are left out, SymbolCache and CandleStore keep them as long as their callers allow
+API_CACHE_POLICY = {"getChartLastRequest": 60, "getSymbol": QUOTE_MAX_AGE,
+                    "getCalendar": 300, "getMarginLevel": 5, "getCurrentUserData": 300}
+
+# history fetched for indicators that do not ask for more (in days)
+INDICATOR_LOOKBACK_DAYS = 19
+
+# how many times a pending transaction status is asked for before giving up
+API_STATUS_TRIES = 10
 
 # max connection tries
 API_MAX_CONN_TRIES = 4
 
+# shortest main loop, the rest is slept away (in s)
+LOOP_MIN_INTERVAL = 60
+
+# how often the main loop mails its report (in s)
+REPORT_INTERVAL = 1800
+
+# how long NBP exchange rates are reused (in s), the table is published once a day
+NBP_RATES_TTL = 3600
+
+# how long the economic calendar is reused across main loops (in s)
+CALENDAR_TTL = 300
+
 # logger properties
 logger = logging.getLogger("jsonSocket")
 FORMAT = '[%(asctime)-15s][%(funcName)s:%(lineno)d] %(message)s'
@@ -70,8 +157,162 @@ class TransactionType(object):
     ORDER_DELETE = 4
 
 
+class TradeRecordType(object):
+    OPEN = 0
+    PENDING = 1
+    CLOSE = 2
+
+
+class TransactionStatus(object):
+    ERROR = 0
+    PENDING = 1
+    ACCEPTED = 3
+    REJECTED = 4
+
+
+class RateLimiter(object):
+    # token bucket - one token per API_SEND_TIMEOUT, up to API_SEND_BURST tokens
+    def __init__(self, interval=API_SEND_TIMEOUT/1000, burst=API_SEND_BURST):
+        self._interval = interval
+        self._burst = burst
+        self._tokens = float(burst)
+        self._lastRefill = time.monotonic()
+        self._lock = Lock()
+
+    def reserve(self):
+        # takes one token and returns how long the caller has to wait for it
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._burst, self._tokens +
+                               (now - self._lastRefill) / self._interval)
+            self._lastRefill = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens * self._interval
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class JsonCodec(object):
+    # stdlib json - always available
+    name = "json"
+
+    @staticmethod
+    def dumps(obj):
+        return json.dumps(obj).encode('utf-8')
+
+    @staticmethod
+    def loads(data):
+        return json.loads(data)
+
+
+class OrjsonCodec(object):
+    # orjson - encodes to and decodes from bytes, several times faster on chart payloads
+    name = "orjson"
+
+    @staticmethod
+    def dumps(obj):
+        return orjson.dumps(obj)
+
+    @staticmethod
+    def loads(data):
+        return orjson.loads(data)
+
+
+DEFAULT_CODEC = OrjsonCodec if orjson != None else JsonCodec
+
+
+class Histogram(object):
+    # power of two buckets - one integer increment per value
+    def __init__(self):
+        self.buckets = [0] * 64
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, value):
+        value = int(value)
+        self.buckets[value.bit_length()] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, share):
+        # upper bound of the bucket holding the given share of values
+        limit = share * self.count
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if count > 0 and seen >= limit:
+                return min(2 ** bucket - 1, self.max)
+        return 0
+
+    def summary(self):
+        if self.count == 0:
+            return {}
+        return {"mean": round(self.total / self.count),
+                "p50": self.percentile(0.5),
+                "p99": self.percentile(0.99),
+                "max": self.max}
+
+
+class CommandStats(object):
+    # per command counters and histograms - bytes in bytes, times in microseconds
+    fields = ("sent", "received", "latency", "decode", "rateWait")
+
+    def __init__(self):
+        self._lock = Lock()
+        self._commands = {}
+
+    def record(self, command, bytesSent, bytesReceived, latency, decodeTime, rateWait):
+        with self._lock:
+            histograms = self._commands.get(command)
+            if histograms == None:
+                histograms = {field: Histogram()
+                              for field in CommandStats.fields
+                              }
+                self._commands[command] = histograms
+            histograms["sent"].add(bytesSent)
+            histograms["received"].add(bytesReceived)
+            histograms["latency"].add(latency * 1000000)
+            histograms["decode"].add(decodeTime * 1000000)
+            histograms["rateWait"].add(rateWait * 1000000)
+
+    def summary(self):
+        with self._lock:
+            return {command: dict({"requests": histograms["latency"].count,
+                                   "sent total": histograms["sent"].total,
+                                   "received total": histograms["received"].total},
+                                  **{field: histograms[field].summary()
+                                     for field in CommandStats.fields
+                                     })
+                    for command, histograms in self._commands.items()
+                    }
+
+    def report(self):
+        lines = []
+        for command, summary in sorted(self.summary().items()):
+            lines.append("%s: %d req, sent %d B, received %d B, latency us %s, decode us %s, rate wait us %s" % (
+                command, summary["requests"], summary["sent total"], summary["received total"],
+                summary["latency"], summary["decode"], summary["rateWait"]))
+        return "\n".join(lines)
+
+    def reset(self):
+        with self._lock:
+            self._commands = {}
+
+
+apiStats = CommandStats()
+
+
 class JsonSocket(object):
-    def __init__(self, address, port, encrypt=False):
+    def __init__(self, address, port, encrypt=False, rateLimiter=None, codec=None):
         self._ssl = encrypt
         if self._ssl != True:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -82,8 +323,17 @@ class JsonSocket(object):
         self._timeout = None
         self._address = address
         self._port = port
-        self._decoder = json.JSONDecoder()
-        self._receivedData = ''
+        self._receivedData = bytearray()
+        self._searchFrom = 0
+        # (bytes, rate limit wait) of the last send, (bytes, frame complete time, decode time) of the last read
+        self.lastSend = (0, 0.0)
+        self.lastRead = (0, 0.0, 0.0)
+        if rateLimiter == None:
+            rateLimiter = RateLimiter()
+        self._rateLimiter = rateLimiter
+        if codec == None:
+            codec = DEFAULT_CODEC
+        self._codec = codec
 
     def connect(self):
         for _ in range(API_MAX_CONN_TRIES):
@@ -99,37 +349,52 @@ class JsonSocket(object):
         return False
 
     def _sendObj(self, obj):
-        msg = json.dumps(obj)
+        msg = self._codec.dumps(obj) + API_MESSAGE_END
         self._waitingSend(msg)
 
     def _waitingSend(self, msg):
         if self.socket:
             sent = 0
-            msg = msg.encode('utf-8')
+            if isinstance(msg, str):
+                msg = msg.encode('utf-8')
+            rateWait = self._rateLimiter.acquire()
             while sent < len(msg):
                 sent += self.conn.send(msg[sent:])
                 # logger.info('Sent: ' + str(msg))
-                time.sleep(API_SEND_TIMEOUT/1000)
+            self.lastSend = (sent, rateWait)
 
-    def _read(self, bytesSize=4096):
+    def _read(self, bytesSize=65536):
         if not self.socket:
             raise RuntimeError("socket connection broken")
         while True:
-            char = self.conn.recv(bytesSize).decode()
-            self._receivedData += char
-            try:
-                (resp, size) = self._decoder.raw_decode(self._receivedData)
-                if size == len(self._receivedData):
-                    self._receivedData = ''
-                    break
-                elif size < len(self._receivedData):
-                    self._receivedData = self._receivedData[size:].strip()
-                    break
-            except ValueError as e:
-                continue
+            frame = self._nextFrame()
+            if frame != None:
+                break
+            chunk = self.conn.recv(bytesSize)
+            if not chunk:
+                raise RuntimeError("socket connection broken")
+            self._receivedData += chunk
+        framedAt = time.perf_counter()
+        resp = self._codec.loads(frame)
+        self.lastRead = (len(frame) + len(API_MESSAGE_END), framedAt,
+                         time.perf_counter() - framedAt)
         # logger.info('Received: ' + str(resp))
         return resp
 
+    def _nextFrame(self):
+        # cuts one complete message from the buffer, scanning only new bytes
+        while True:
+            end = self._receivedData.find(API_MESSAGE_END, self._searchFrom)
+            if end == -1:
+                self._searchFrom = max(
+                    0, len(self._receivedData) - len(API_MESSAGE_END) + 1)
+                return None
+            frame = bytes(self._receivedData[:end])
+            del self._receivedData[:end + len(API_MESSAGE_END)]
+            self._searchFrom = 0
+            if frame.strip():
+                return frame
+
     def _readObj(self):
         msg = self._read()
         return msg
@@ -181,27 +446,999 @@ class JsonSocket(object):
                        doc='read only property socket port')
 
 
+class SocketTransport(object):
+    # sends a command over the client's own socket and waits for the response
+    def __init__(self, jsonSocket):
+        self._socket = jsonSocket
+
+    def execute(self, dictionary):
+        self._socket._sendObj(dictionary)
+        sentAt = time.perf_counter()
+        response = self._socket._readObj()
+
+        bytesSent, rateWait = self._socket.lastSend
+        bytesReceived, framedAt, decodeTime = self._socket.lastRead
+        apiStats.record(dictionary['command'], bytesSent, bytesReceived,
+                        framedAt - sentAt, decodeTime, rateWait)
+        return response
+
+    def close(self):
+        pass
+
+
+class RecordingTransport(object):
+    # passes commands to another transport and appends each exchange to a json lines file
+    _fileLock = Lock()
+
+    def __init__(self, transport, path):
+        self._transport = transport
+        self._path = path
+        self._start = time.monotonic()
+
+    def execute(self, dictionary):
+        startCounter = time.perf_counter()
+        response = self._transport.execute(dictionary)
+        elapsed = time.perf_counter() - startCounter
+
+        request = dictionary
+        if dictionary['command'] == 'login':
+            request = baseCommand('login', dict(
+                dictionary['arguments'], password='***'))
+        record = {"t": round(time.monotonic() - self._start - elapsed, 4),
+                  "dt": round(elapsed, 4),
+                  "request": request,
+                  "response": response}
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with RecordingTransport._fileLock:
+            with open(self._path, "a", encoding="UTF-8") as recordFile:
+                recordFile.write(line)
+        return response
+
+    def close(self):
+        self._transport.close()
+
+
+class ReplayTransport(object):
+    # answers commands from a recorded file without a socket, in recorded order per request
+    def __init__(self, path, realTime=False):
+        self._realTime = realTime
+        self._byRequest = {}
+        self._lock = Lock()
+        with open(path, "r", encoding="UTF-8") as recordFile:
+            for line in recordFile:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                exchange = (record["dt"], record["response"])
+                self._byRequest.setdefault(ReplayTransport.request_key(
+                    record["request"]), deque()).append(exchange)
+
+    @staticmethod
+    def request_key(dictionary):
+        # chart start/end follow the wall clock, so they are not part of the key
+        def normalise(value):
+            if isinstance(value, dict):
+                return {key: normalise(value[key])
+                        for key in value
+                        if key not in ("start", "end", "password")
+                        }
+            return value
+        return json.dumps(normalise(dictionary), sort_keys=True)
+
+    def execute(self, dictionary):
+        with self._lock:
+            # a response recorded for other arguments would silently corrupt the replay
+            exchanges = self._byRequest.get(
+                ReplayTransport.request_key(dictionary))
+            if not exchanges:
+                if dictionary['command'] == 'ping':
+                    return {"status": True}
+                raise KeyError("No recorded response for " +
+                               ReplayTransport.request_key(dictionary))
+            # the last answer is kept for requests repeated more often than recorded
+            if len(exchanges) > 1:
+                elapsed, response = exchanges.popleft()
+            else:
+                elapsed, response = exchanges[0]
+        if self._realTime:
+            time.sleep(elapsed)
+        return deepcopy(response)
+
+    def close(self):
+        pass
+
+
 class APIClient(JsonSocket):
-    def __init__(self, address=DEFAULT_XAPI_ADDRESS, port=DEFAULT_XAPI_PORT, encrypt=True):
-        super(APIClient, self).__init__(address, port, encrypt)
-        if(not self.connect()):
-            raise Exception("Cannot connect to " + address + ":" +
-                            str(port) + " after " + str(API_MAX_CONN_TRIES) + " retries")
+    def __init__(self, address=DEFAULT_XAPI_ADDRESS, port=DEFAULT_XAPI_PORT, encrypt=True, rateLimiter=None,
+                 transport=None, recordPath=None, codec=None):
+        super(APIClient, self).__init__(address, port, encrypt, rateLimiter, codec)
+        if transport == None:
+            if(not self.connect()):
+                raise Exception("Cannot connect to " + address + ":" +
+                                str(port) + " after " + str(API_MAX_CONN_TRIES) + " retries")
+            transport = SocketTransport(self)
+        if recordPath != None:
+            transport = RecordingTransport(transport, recordPath)
+        self._transport = transport
 
     def execute(self, dictionary):
-        self._sendObj(dictionary)
-        return self._readObj()
+        return self._transport.execute(dictionary)
 
     def disconnect(self):
+        self._transport.close()
         self.close()
 
     def commandExecute(self, commandName, arguments=None):
         return self.execute(baseCommand(commandName, arguments))
 
 
+class RequestCoalescer(object):
+    # identical commands within one cycle share one response, concurrent callers wait for the request in flight
+    def __init__(self, policy=API_CACHE_POLICY):
+        self.policy = policy
+        self._entries = {}
+        self._lock = Lock()
+        self.sent = 0
+        self.shared = 0
+
+    @staticmethod
+    def key(commandName, arguments):
+        if commandName in ("getChartRangeRequest", "getChartLastRequest") and arguments != None:
+            # end is always "now", the bars asked for are given by start
+            arguments = {**arguments, "info": {name: value
+                                               for name, value in arguments["info"].items()
+                                               if name != "end"
+                                               }}
+        return commandName + json.dumps(arguments, sort_keys=True)
+
+    def execute(self, function, commandName, arguments=None):
+        maxAge = self.policy.get(commandName)
+        if maxAge == None:
+            return function()
+        key = RequestCoalescer.key(commandName, arguments)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry != None and (not entry[1].done() or time.monotonic() - entry[0] < maxAge):
+                self.shared += 1
+                owner = False
+            else:
+                entry = (time.monotonic(), Future())
+                self._entries[key] = entry
+                self.sent += 1
+                owner = True
+        future = entry[1]
+        if owner:
+            try:
+                response = function()
+            except Exception as msg:
+                self._forget(key, entry)
+                future.set_exception(msg)
+                raise
+            if response.get("status") == False:
+                self._forget(key, entry)
+            future.set_result(response)
+        return deepcopy(future.result())
+
+    def _forget(self, key, entry):
+        with self._lock:
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+
+    def begin_cycle(self):
+        # responses of the previous cycle are not shared any more, requests in flight are still awaited
+        with self._lock:
+            self._entries = {key: entry
+                             for key, entry in self._entries.items()
+                             if not entry[1].done()
+                             }
+
+    def stats(self):
+        return {"sent": self.sent, "shared": self.shared}
+
+
+class APISession(object):
+    # long lived, logged in APIClient - pings when idle, reconnects when the socket dies
+    def __init__(self, userId, password, address=DEFAULT_XAPI_ADDRESS, port=DEFAULT_XAPI_PORT,
+                 encrypt=True, rateLimiter=None, pingInterval=API_PING_INTERVAL,
+                 streamPort=DEFUALT_XAPI_STREAMING_PORT, transport=None, recordPath=API_RECORD_PATH,
+                 cachePolicy=API_CACHE_POLICY):
+        self.coalescer = RequestCoalescer(cachePolicy)
+        self._transport = transport
+        self._recordPath = recordPath
+        self._userId = userId
+        self._password = password
+        self._address = address
+        self._port = port
+        self._streamPort = streamPort
+        self._encrypt = encrypt
+        self._rateLimiter = rateLimiter
+        self._pingInterval = pingInterval
+        self._lock = RLock()
+        self.client = None
+        self.streamSessionId = None
+        self.streamClient = None
+        self.quoteBook = None
+        self.positionBook = None
+        self.candleBook = None
+        self._streamSymbols = []
+        self.reconnects = 0
+
+        self._login()
+
+        self._stopped = Event()
+        self._t = Thread(target=self._keepAlive, args=())
+        self._t.setDaemon(True)
+        self._t.start()
+
+    def _login(self):
+        client = APIClient(self._address, self._port, self._encrypt, self._rateLimiter,
+                           transport=self._transport, recordPath=self._recordPath)
+        loginResponse = client.execute(
+            loginCommand(userId=self._userId, password=self._password))
+        if loginResponse['status'] == False:
+            client.disconnect()
+            raise Exception('Login failed. Error code: {0}'.format(
+                loginResponse['errorCode']))
+        self.client = client
+        self.streamSessionId = loginResponse['streamSessionId']
+        self._lastUsed = time.monotonic()
+
+    def reconnect(self):
+        with self._lock:
+            try:
+                self.client.disconnect()
+            except (socket.error, RuntimeError):
+                pass
+            self._login()
+            self.reconnects += 1
+            if self.streamClient != None:
+                self._openStream()
+
+    def execute(self, dictionary):
+        with self._lock:
+            try:
+                response = self.client.execute(dictionary)
+            except (socket.error, RuntimeError, ValueError) as msg:
+                logger.error("Session lost: %s" % msg)
+                self.reconnect()
+                # never resend a transaction, it could have reached the server
+                if dictionary['command'] == 'tradeTransaction':
+                    raise
+                response = self.client.execute(dictionary)
+            if response.get('status') == False and response.get('errorCode') in API_RELOGIN_ERRORS:
+                logger.error("Session expired: %s" % response['errorCode'])
+                self.reconnect()
+                response = self.client.execute(dictionary)
+            self._lastUsed = time.monotonic()
+            return response
+
+    def commandExecute(self, commandName, arguments=None):
+        return self.coalescer.execute(lambda: self.execute(baseCommand(commandName, arguments)),
+                                      commandName, arguments)
+
+    def begin_cycle(self):
+        self.coalescer.begin_cycle()
+
+    def start_streaming(self, symbols):
+        # keeps self.quoteBook, self.positionBook and self.candleBook up to date from the stream
+        with self._lock:
+            if self.quoteBook == None:
+                self.quoteBook = QuoteBook()
+            if self.positionBook == None:
+                self.positionBook = PositionBook()
+            if self.candleBook == None:
+                self.candleBook = CandleBook({symbol: symbolCache.precision(self, symbol)
+                                              for symbol in symbols
+                                              }, quoteBook=self.quoteBook)
+            self._streamSymbols = list(symbols)
+            self._openStream()
+
+    def _openStream(self):
+        self._closeStream()
+        self.streamClient = APIStreamClient(self._address, self._streamPort, self._encrypt,
+                                            ssId=self.streamSessionId, tickFun=self.quoteBook.update,
+                                            tradeFun=self.positionBook.on_trade,
+                                            tradeStatusFun=self.positionBook.on_trade_status,
+                                            profitFun=self.positionBook.on_profit,
+                                            candleFun=self.candleBook.update)
+        self.candleBook.restart()
+        self.streamClient.subscribePrices(self._streamSymbols)
+        self.streamClient.subscribeCandles(self._streamSymbols)
+        self.streamClient.subscribeTrades()
+        self.streamClient.subscribeTradeStatus()
+        self.streamClient.subscribeProfits()
+        # seeded after subscribing, so no update falls between the two
+        self.positionBook.seed(self)
+        self._lastStreamPing = time.monotonic()
+
+    def _closeStream(self):
+        if self.streamClient != None:
+            try:
+                self.streamClient.disconnect()
+            except (socket.error, RuntimeError):
+                pass
+            self.streamClient = None
+
+    def _keepAlive(self):
+        while not self._stopped.wait(1):
+            try:
+                if self.streamClient != None:
+                    with self._lock:
+                        if not self.streamClient.is_alive():
+                            logger.error("Stream lost, reconnecting")
+                            self._openStream()
+                        elif time.monotonic() - self._lastStreamPing >= self._pingInterval:
+                            self.streamClient.ping()
+                            self._lastStreamPing = time.monotonic()
+                if time.monotonic() - self._lastUsed >= self._pingInterval:
+                    self.commandExecute('ping')
+            except Exception as msg:
+                logger.error("Ping failed: %s" % msg)
+
+    def stream_stats(self):
+        if self.streamClient == None:
+            return {}
+        return self.streamClient.dispatcher.stats()
+
+    def disconnect(self):
+        self._stopped.set()
+        self._t.join()
+        with self._lock:
+            self._closeStream()
+            self.client.disconnect()
+
+
+class APIClientPool(object):
+    # logged in sessions sharing one rate budget, for fetching data of many pairs at once
+    def __init__(self, userId, password, size=API_POOL_SIZE, rateLimiter=None,
+                 cachePolicy=API_CACHE_POLICY, **sessionArguments):
+        if rateLimiter == None:
+            rateLimiter = RateLimiter()
+        self.rateLimiter = rateLimiter
+        self.coalescer = RequestCoalescer(cachePolicy)
+        self._sessions = [APISession(userId, password, rateLimiter=rateLimiter, **sessionArguments)
+                          for _ in range(size)
+                          ]
+        self.streamSessionId = self._sessions[0].streamSessionId
+
+        self._idle = queue.Queue()
+        for index in range(size):
+            self._idle.put(index)
+        self._statsLock = Lock()
+        self._busyTime = [0.0] * size
+        self._requests = [0] * size
+        self._statsStart = time.monotonic()
+        self._executor = ThreadPoolExecutor(max_workers=size)
+
+    @contextmanager
+    def checkout(self):
+        index = self._idle.get()
+        startCounter = time.monotonic()
+        try:
+            yield self._sessions[index]
+        finally:
+            with self._statsLock:
+                self._busyTime[index] += time.monotonic() - startCounter
+                self._requests[index] += 1
+            self._idle.put(index)
+
+    def execute(self, dictionary):
+        with self.checkout() as session:
+            return session.execute(dictionary)
+
+    def commandExecute(self, commandName, arguments=None):
+        return self.coalescer.execute(lambda: self.execute(baseCommand(commandName, arguments)),
+                                      commandName, arguments)
+
+    def begin_cycle(self):
+        self.coalescer.begin_cycle()
+
+    def map(self, function, iterable):
+        return list(self._executor.map(function, iterable))
+
+    def start_streaming(self, symbols):
+        self._sessions[0].start_streaming(symbols)
+
+    @property
+    def quoteBook(self):
+        return self._sessions[0].quoteBook
+
+    @property
+    def positionBook(self):
+        return self._sessions[0].positionBook
+
+    @property
+    def candleBook(self):
+        return self._sessions[0].candleBook
+
+    def stream_stats(self):
+        return self._sessions[0].stream_stats()
+
+    def utilisation(self):
+        # share of time each connection was checked out since the last reset
+        with self._statsLock:
+            elapsed = max(time.monotonic() - self._statsStart, 1e-9)
+            return {index: {"busy": round(self._busyTime[index] / elapsed, 3),
+                            "requests": self._requests[index]}
+                    for index in range(len(self._sessions))
+                    }
+
+    def reset_utilisation(self):
+        with self._statsLock:
+            self._busyTime = [0.0] * len(self._sessions)
+            self._requests = [0] * len(self._sessions)
+            self._statsStart = time.monotonic()
+
+    def disconnect(self):
+        self._executor.shutdown()
+        for session in self._sessions:
+            session.disconnect()
+
+
+class AsyncAPIClient(object):
+    # asyncio client - many commands in flight, responses matched by customTag
+    def __init__(self, address=DEFAULT_XAPI_ADDRESS, port=DEFAULT_XAPI_PORT, encrypt=True, rateLimiter=None,
+                 codec=None):
+        self._address = address
+        self._port = port
+        self._ssl = encrypt
+        if rateLimiter == None:
+            rateLimiter = RateLimiter()
+        self._rateLimiter = rateLimiter
+        if codec == None:
+            codec = DEFAULT_CODEC
+        self._codec = codec
+        self._tags = itertools.count()
+        self._pending = {}
+        self._reader = None
+        self._writer = None
+        self._readerTask = None
+        self._closing = False
+        self.streamSessionId = None
+
+    async def connect(self):
+        sslContext = ssl.create_default_context() if self._ssl else None
+        self._reader, self._writer = await asyncio.open_connection(
+            self._address, self._port, ssl=sslContext, limit=API_ASYNC_READ_LIMIT)
+        self._readerTask = asyncio.ensure_future(self._readResponses())
+
+    async def login(self, userId, password, appName=''):
+        loginResponse = await self.execute(loginCommand(userId, password, appName))
+        if loginResponse['status'] == False:
+            raise Exception('Login failed. Error code: {0}'.format(
+                loginResponse['errorCode']))
+        self.streamSessionId = loginResponse['streamSessionId']
+        return loginResponse
+
+    async def execute(self, dictionary):
+        # no response can arrive once the reader has stopped
+        if self._readerTask != None and self._readerTask.done():
+            raise RuntimeError("socket connection broken")
+        customTag = str(next(self._tags))
+        future = asyncio.get_running_loop().create_future()
+        self._pending[customTag] = future
+
+        wait = self._rateLimiter.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        self._writer.write(self._codec.dumps(
+            dict(dictionary, customTag=customTag)) + API_MESSAGE_END)
+        await self._writer.drain()
+        return await future
+
+    async def commandExecute(self, commandName, arguments=None):
+        return await self.execute(baseCommand(commandName, arguments))
+
+    async def _readResponses(self):
+        try:
+            while True:
+                frame = await self._reader.readuntil(API_MESSAGE_END)
+                if not frame.strip():
+                    continue
+                response = self._codec.loads(frame)
+                future = self._pending.pop(response.get('customTag'), None)
+                if future != None and not future.done():
+                    future.set_result(response)
+        except Exception as msg:
+            # also a frame over API_ASYNC_READ_LIMIT or one the codec cannot decode, nothing more is read
+            if not self._closing:
+                logger.error("Async connection lost: %s" % msg)
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(
+                        RuntimeError("socket connection broken"))
+            self._pending = {}
+
+    async def charts(self, pairs, timeFrame, startTime=None):
+        pairs = list(pairs)
+        responses = await asyncio.gather(*[self.commandExecute("getChartRangeRequest",
+                                                               Chart.chart_arguments(pair, timeFrame, startTime))
+                                           for pair in pairs
+                                           ])
+        return {pair: Chart(None, pair, timeFrame, rateInfos=response["returnData"]["rateInfos"],
+                            digits=response["returnData"]["digits"])
+                for pair, response in zip(pairs, responses)
+                }
+
+    async def bid_ask(self, pairs):
+        pairs = list(pairs)
+        responses = await asyncio.gather(*[self.commandExecute("getSymbol", {"symbol": pair})
+                                           for pair in pairs
+                                           ])
+        return BidAsk(None, pairs, symbolsInfo={pair: response["returnData"]
+                                                for pair, response in zip(pairs, responses)
+                                                })
+
+    async def current_trades(self):
+        response = await self.commandExecute("getTrades", {"openedOnly": True})
+        return CurrentTrades(None, openedTradesFullInfo=response["returnData"])
+
+    async def disconnect(self):
+        self._closing = True
+        self._writer.close()
+        await self._writer.wait_closed()
+        await self._readerTask
+
+
+def map_pairs(client, function, pairs):
+    # calls function for every pair, concurrently when client is a pool
+    pairs = list(pairs)
+    if isinstance(client, APIClientPool):
+        return dict(zip(pairs, client.map(function, pairs)))
+    return {pair: function(pair)
+            for pair in pairs
+            }
+
+
+class Quote(object):
+    __slots__ = ("symbol", "bid", "ask", "spread", "timestamp", "received")
+
+    def __init__(self, symbol, bid, ask, timestamp):
+        self.symbol = symbol
+        self.bid = bid
+        self.ask = ask
+        self.spread = round(ask - bid, 5)
+        # server time of the tick (in ms) and local arrival time
+        self.timestamp = timestamp
+        self.received = time.monotonic()
+
+    def age(self):
+        return time.monotonic() - self.received
+
+
+class QuoteBook(object):
+    # latest top of book per symbol, fed by APIStreamClient tickFun
+    def __init__(self):
+        self._quotes = {}
+        self._lock = Lock()
+        self._listeners = []
+
+    def update(self, msg):
+        data = msg["data"]
+        if data.get("level", 0) != 0:
+            return
+        quote = Quote(data["symbol"], data["bid"],
+                      data["ask"], data["timestamp"])
+        with self._lock:
+            self._quotes[quote.symbol] = quote
+        for listener in self._listeners:
+            listener(quote)
+
+    def add_listener(self, function):
+        self._listeners.append(function)
+
+    def get(self, symbol, maxAge=QUOTE_MAX_AGE):
+        # None when there is no quote or it is older than maxAge
+        with self._lock:
+            quote = self._quotes.get(symbol)
+        if quote == None or quote.age() > maxAge:
+            return None
+        return quote
+
+    def symbols(self):
+        with self._lock:
+            return list(self._quotes.keys())
+
+
+class CandleBook(object):
+    # M1 bars from the candle stream per symbol, kept as raw chart bars (open in points, the rest relative to open)
+    # the newest bar is forming until a newer one arrives or its minute is over
+    def __init__(self, digits, size=CANDLE_BOOK_SIZE, quoteBook=None):
+        self.digits = dict(digits)
+        self.quoteBook = quoteBook
+        self._size = size
+        self._bars = {}
+        self._lock = Lock()
+
+    def restart(self):
+        # bars may be missing after resubscribing, the history starts again
+        with self._lock:
+            self._bars = {}
+
+    def update(self, msg):
+        data = msg["data"]
+        symbol = data["symbol"]
+        if symbol not in self.digits:
+            return
+        scale = 10 ** self.digits[symbol]
+        barOpen = round(data["open"] * scale)
+        bar = {"ctm": data["ctm"],
+               "open": barOpen,
+               "high": round(data["high"] * scale) - barOpen,
+               "low": round(data["low"] * scale) - barOpen,
+               "close": round(data["close"] * scale) - barOpen,
+               "vol": data["vol"]}
+        with self._lock:
+            bars = self._bars.setdefault(symbol, deque(maxlen=self._size))
+            if bars and bars[-1]["ctm"] > bar["ctm"]:
+                return
+            if bars and bars[-1]["ctm"] == bar["ctm"]:
+                bars[-1] = bar
+            else:
+                bars.append(bar)
+
+    def closed_until(self, symbol):
+        # end of the newest streamed bar whose minute is over (in ms), bars ending by then are complete
+        with self._lock:
+            bars = self._bars.get(symbol)
+            if not bars:
+                return 0
+            end = bars[-1]["ctm"] + 60000
+        return end if end <= time.time() * 1000 else end - 60000
+
+    def covers(self, symbol, start):
+        # True when every bar since start came from the stream and the newest one is recent
+        with self._lock:
+            bars = self._bars.get(symbol)
+            if not bars:
+                return False
+            return bars[0]["ctm"] <= start and time.time() * 1000 - bars[-1]["ctm"] < 120000
+
+    def rate_infos(self, symbol, start=None):
+        with self._lock:
+            bars = self._bars.get(symbol, [])
+            rateInfos = [dict(bar)
+                         for bar in bars
+                         if start == None or bar["ctm"] >= start
+                         ]
+            last = dict(bars[-1]) if bars else None
+        forming = self._forming(symbol, last)
+        if forming != None and (start == None or forming["ctm"] >= start):
+            if rateInfos and rateInfos[-1]["ctm"] == forming["ctm"]:
+                rateInfos[-1] = forming
+            else:
+                rateInfos.append(forming)
+        return rateInfos
+
+    def _forming(self, symbol, last):
+        # the stream sends a bar only when its minute is over, the latest bid brings the forming one up to date
+        # None when there is no fresh quote or the bar of the previous minute has not arrived yet - a bar
+        # started before it would end the delta of CandleStore past a longer bar that is still incomplete
+        if self.quoteBook == None or last == None:
+            return None
+        quote = self.quoteBook.get(symbol)
+        if quote == None:
+            return None
+        ctm = quote.timestamp // 60000 * 60000
+        price = round(quote.bid * 10 ** self.digits[symbol])
+        if ctm == last["ctm"]:
+            return {**last,
+                    "high": max(last["high"], price - last["open"]),
+                    "low": min(last["low"], price - last["open"]),
+                    "close": price - last["open"]}
+        if ctm == last["ctm"] + 60000:
+            return {"ctm": ctm, "open": price, "high": 0, "low": 0, "close": 0, "vol": 0}
+        return None
+
+    def symbols(self):
+        with self._lock:
+            return list(self._bars.keys())
+
+
+class PositionBook(object):
+    # open positions seeded from getTrades, then kept up to date by trade, tradeStatus and profit streams
+    def __init__(self):
+        self._positions = {}
+        self._lock = Lock()
+        self.tradeStatuses = {}
+        self.seeded = False
+
+    def seed(self, client):
+        trades = client.commandExecute(
+            "getTrades", {"openedOnly": True})["returnData"]
+        with self._lock:
+            self._positions = {trade["position"]: trade
+                               for trade in trades
+                               if trade["cmd"] in (TransactionSide.BUY, TransactionSide.SELL)
+                               }
+            self.seeded = True
+
+    def on_trade(self, msg):
+        data = msg["data"]
+        if data["cmd"] not in (TransactionSide.BUY, TransactionSide.SELL):
+            return
+        # pending records are orders the server has not opened yet, the open position comes in its own record
+        if data["type"] == TradeRecordType.PENDING:
+            return
+        with self._lock:
+            if data["closed"] or data.get("state") == "Deleted":
+                self._positions.pop(data["position"], None)
+            else:
+                position = self._positions.setdefault(data["position"], {})
+                position.update(data)
+
+    def on_trade_status(self, msg):
+        data = msg["data"]
+        with self._lock:
+            self.tradeStatuses[data["order"]] = data
+
+    def on_profit(self, msg):
+        data = msg["data"]
+        with self._lock:
+            if data["position"] in self._positions:
+                self._positions[data["position"]]["profit"] = data["profit"]
+
+    def trades(self):
+        with self._lock:
+            return [dict(trade)
+                    for trade in self._positions.values()
+                    ]
+
+    def current_trades(self):
+        return CurrentTrades(None, openedTradesFullInfo=self.trades())
+
+
+class StopLossWatchdog(object):
+    # closes a position on the first tick that passed its stop loss or take profit
+    def __init__(self, client, positionBook, quoteBook):
+        self._client = client
+        self._positionBook = positionBook
+        self._closing = set()
+        self._lock = Lock()
+        self._queue = queue.Queue()
+        self.latencies = deque(maxlen=100)
+
+        self._t = Thread(target=self._closeWorker, args=())
+        self._t.setDaemon(True)
+        self._t.start()
+        quoteBook.add_listener(self.on_quote)
+
+    @staticmethod
+    def is_breached(trade, quote):
+        # 0 means the level is not set
+        if trade["cmd"] == TransactionSide.BUY:
+            return (trade["sl"] != 0 and quote.bid < trade["sl"]) or \
+                (trade["tp"] != 0 and quote.bid > trade["tp"])
+        elif trade["cmd"] == TransactionSide.SELL:
+            return (trade["sl"] != 0 and quote.ask > trade["sl"]) or \
+                (trade["tp"] != 0 and quote.ask < trade["tp"])
+        return False
+
+    def on_quote(self, quote):
+        trades = [trade
+                  for trade in self._positionBook.trades()
+                  if trade["symbol"] == quote.symbol
+                  ]
+        with self._lock:
+            if quote.symbol in self._closing:
+                # closed already once the stream removed the position
+                if trades == []:
+                    self._closing.discard(quote.symbol)
+                return
+            if any(StopLossWatchdog.is_breached(trade, quote) for trade in trades):
+                self._closing.add(quote.symbol)
+                self._queue.put(quote)
+
+    def _closeWorker(self):
+        while True:
+            quote = self._queue.get()
+            if quote == None:
+                break
+            try:
+                currentTrades = self._positionBook.current_trades()
+                if quote.symbol in currentTrades.openedTradesOnlyPairs:
+                    responses = currentTrades.close_trades(
+                        self._client, [quote.symbol])
+                    if not self._confirmed(responses[quote.symbol]):
+                        raise RuntimeError("close of %s not accepted: %s" % (
+                            quote.symbol, responses[quote.symbol]))
+                    latency = (time.monotonic() - quote.received) * 1000
+                    self.latencies.append(latency)
+                    logger.info("Watchdog closed %s at bid %s ask %s, tick to close %.1f ms" % (
+                        quote.symbol, quote.bid, quote.ask, latency))
+            except Exception as msg:
+                # the next quote past the level tries again
+                logger.error("Watchdog close failed: %s" % msg)
+                with self._lock:
+                    self._closing.discard(quote.symbol)
+
+    def _confirmed(self, response):
+        # True once tradeTransactionStatus reports the close accepted
+        if response.get("status") != True:
+            return False
+        order = response["returnData"]["order"]
+        for _ in range(API_STATUS_TRIES):
+            status = self._client.commandExecute(
+                "tradeTransactionStatus", {"order": order})
+            if status.get("status") != True:
+                return False
+            requestStatus = status["returnData"]["requestStatus"]
+            if requestStatus != TransactionStatus.PENDING:
+                return requestStatus == TransactionStatus.ACCEPTED
+            time.sleep(API_SEND_TIMEOUT / 1000)
+        return False
+
+    def latency_summary(self):
+        latencies = sorted(self.latencies)
+        if latencies == []:
+            return {}
+        return {"closes": len(latencies),
+                "median ms": round(latencies[len(latencies) // 2], 1),
+                "max ms": round(latencies[-1], 1)}
+
+    def disconnect(self):
+        self._queue.put(None)
+        self._t.join()
+        self._client.disconnect()
+
+
+class SymbolCache(object):
+    # getAllSymbols indexed by symbol, loaded in one request and refreshed after ttl
+    def __init__(self, ttl=SYMBOLS_CACHE_TTL):
+        self._ttl = ttl
+        self._symbols = {}
+        self._loadedAt = None
+        self._lock = Lock()
+
+    def refresh(self, client):
+        symbols = client.commandExecute("getAllSymbols")["returnData"]
+        self._symbols = {symbolInfo["symbol"]: symbolInfo
+                         for symbolInfo in symbols
+                         }
+        self._loadedAt = time.monotonic()
+
+    def get(self, client, symbol, maxAge=None):
+        # maxAge lower than ttl is used when prices from the snapshot are needed
+        if maxAge == None:
+            maxAge = self._ttl
+        with self._lock:
+            if self._loadedAt == None or time.monotonic() - self._loadedAt > maxAge:
+                self.refresh(client)
+            return self._symbols[symbol]
+
+    def precision(self, client, symbol):
+        return self.get(client, symbol)["precision"]
+
+    def contract_size(self, client, symbol):
+        return self.get(client, symbol)["contractSize"]
+
+    def lot_step(self, client, symbol):
+        return self.get(client, symbol)["lotStep"]
+
+    def currencies(self, client, symbol):
+        symbolInfo = self.get(client, symbol)
+        return symbolInfo["currency"], symbolInfo["currencyProfit"]
+
+
+symbolCache = SymbolCache()
+
+
+class StreamChannel(object):
+    # bounded queue consumed by one worker thread, new messages are dropped when it is full
+    def __init__(self, name, function, maxSize=STREAM_QUEUE_SIZE):
+        self.name = name
+        self._function = function
+        self._queue = queue.Queue(maxSize)
+        self.dropped = 0
+        self.processed = 0
+        self._t = Thread(target=self._work, args=())
+        self._t.setDaemon(True)
+        self._t.start()
+
+    def put(self, msg):
+        try:
+            self._queue.put_nowait(msg)
+        except queue.Full:
+            self.dropped += 1
+
+    def _next(self):
+        return self._queue.get()
+
+    def _work(self):
+        while True:
+            msg = self._next()
+            if msg == None:
+                break
+            try:
+                self._function(msg)
+            except Exception:
+                logger.exception("Stream callback %s failed" % self.name)
+            self.processed += 1
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        return {"depth": self.depth(), "dropped": self.dropped, "processed": self.processed}
+
+    def stop(self):
+        self._queue.put(None)
+        self._t.join()
+
+
+class TickChannel(StreamChannel):
+    # keeps only the newest tick per symbol, so a slow consumer always gets the latest price
+    def __init__(self, name, function):
+        self._latest = OrderedDict()
+        self._condition = Condition()
+        self._stopped = False
+        self.coalesced = 0
+        super(TickChannel, self).__init__(name, function)
+
+    def put(self, msg):
+        symbol = msg["data"]["symbol"]
+        with self._condition:
+            if symbol in self._latest:
+                self.coalesced += 1
+            self._latest[symbol] = msg
+            self._condition.notify()
+
+    def _next(self):
+        with self._condition:
+            while not self._latest and not self._stopped:
+                self._condition.wait()
+            if not self._latest:
+                return None
+            return self._latest.popitem(last=False)[1]
+
+    def depth(self):
+        with self._condition:
+            return len(self._latest)
+
+    def stats(self):
+        return dict(super(TickChannel, self).stats(), coalesced=self.coalesced)
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._t.join()
+
+
+class StreamDispatcher(object):
+    # routes stream messages by command to their channels
+    def __init__(self, functions):
+        self._channels = {}
+        for command, function in functions.items():
+            if function == None:
+                continue
+            if command == 'tickPrices':
+                self._channels[command] = TickChannel(command, function)
+            else:
+                self._channels[command] = StreamChannel(command, function)
+        self.unhandled = 0
+
+    def dispatch(self, msg):
+        channel = self._channels.get(msg.get("command"))
+        if channel == None:
+            self.unhandled += 1
+            return
+        channel.put(msg)
+
+    def stats(self):
+        return {command: channel.stats()
+                for command, channel in self._channels.items()
+                }
+
+    def stop(self):
+        for channel in self._channels.values():
+            channel.stop()
+
+
 class APIStreamClient(JsonSocket):
     def __init__(self, address=DEFAULT_XAPI_ADDRESS, port=DEFUALT_XAPI_STREAMING_PORT, encrypt=True, ssId=None,
-                 tickFun=None, tradeFun=None, balanceFun=None, tradeStatusFun=None, profitFun=None, newsFun=None):
+                 tickFun=None, tradeFun=None, balanceFun=None, tradeStatusFun=None, profitFun=None, newsFun=None,
+                 candleFun=None):
         super(APIStreamClient, self).__init__(address, port, encrypt)
         self._ssId = ssId
 
@@ -211,8 +1448,15 @@ class APIStreamClient(JsonSocket):
         self._tradeStatusFun = tradeStatusFun
         self._profitFun = profitFun
         self._newsFun = newsFun
+        self._candleFun = candleFun
+
+        # callbacks run on channel workers, the reader thread only frames and decodes
+        self.dispatcher = StreamDispatcher({'tickPrices': tickFun, 'trade': tradeFun, 'balance': balanceFun,
+                                            'tradeStatus': tradeStatusFun, 'profit': profitFun, 'news': newsFun,
+                                            'candle': candleFun})
 
         if(not self.connect()):
+            self.dispatcher.stop()
             raise Exception("Cannot connect to streaming on " + address + ":" +
                             str(port) + " after " + str(API_MAX_CONN_TRIES) + " retries")
 
@@ -223,29 +1467,32 @@ class APIStreamClient(JsonSocket):
 
     def _readStream(self):
         while (self._running):
-            msg = self._readObj()
+            try:
+                msg = self._readObj()
+            except socket.timeout:
+                continue
+            except (socket.error, RuntimeError, ValueError) as msg:
+                if self._running:
+                    logger.error("Stream read error: %s" % msg)
+                break
             # logger.info("Stream received: " + str(msg))
-            if (msg["command"] == 'tickPrices'):
-                self._tickFun(msg)
-            elif (msg["command"] == 'trade'):
-                self._tradeFun(msg)
-            elif (msg["command"] == "balance"):
-                self._balanceFun(msg)
-            elif (msg["command"] == "tradeStatus"):
-                self._tradeStatusFun(msg)
-            elif (msg["command"] == "profit"):
-                self._profitFun(msg)
-            elif (msg["command"] == "news"):
-                self._newsFun(msg)
+            self.dispatcher.dispatch(msg)
 
     def disconnect(self):
         self._running = False
         self._t.join()
+        self.dispatcher.stop()
         self.close()
 
+    def is_alive(self):
+        return self._t.is_alive()
+
     def execute(self, dictionary):
         self._sendObj(dictionary)
 
+    def ping(self):
+        self.execute(dict(command='ping', streamSessionId=self._ssId))
+
     def subscribePrice(self, symbol):
         self.execute(dict(command='getTickPrices',
                           symbol=symbol, streamSessionId=self._ssId))
@@ -270,6 +1517,14 @@ class APIStreamClient(JsonSocket):
     def subscribeNews(self):
         self.execute(dict(command='getNews', streamSessionId=self._ssId))
 
+    def subscribeCandle(self, symbol):
+        self.execute(dict(command='getCandles',
+                          symbol=symbol, streamSessionId=self._ssId))
+
+    def subscribeCandles(self, symbols):
+        for symbolX in symbols:
+            self.subscribeCandle(symbolX)
+
     def unsubscribePrice(self, symbol):
         self.execute(dict(command='stopTickPrices',
                           symbol=symbol, streamSessionId=self._ssId))
@@ -294,6 +1549,14 @@ class APIStreamClient(JsonSocket):
     def unsubscribeNews(self):
         self.execute(dict(command='stopNews', streamSessionId=self._ssId))
 
+    def unsubscribeCandle(self, symbol):
+        self.execute(dict(command='stopCandles',
+                          symbol=symbol, streamSessionId=self._ssId))
+
+    def unsubscribeCandles(self, symbols):
+        for symbolX in symbols:
+            self.unsubscribeCandle(symbolX)
+
 
 # Command templates
 def baseCommand(commandName, arguments=None):
@@ -340,6 +1603,12 @@ def procProfitExample(msg):
 def procNewsExample(msg):
     print("NEWS: ", msg)
 
+# example function for processing candles from Streaming socket
+
+
+def procCandleExample(msg):
+    print("CANDLE: ", msg)
+
 # ---------------------------------------------------------------------
 
 
@@ -378,6 +1647,9 @@ def get_important_calendar_events_dict(client, importantCountriesList):
 
 
 class Calendar:
+    # getCalendar is sent again only after CALENDAR_TTL, the coalescer forgets it at every begin_cycle
+    _calendarFromApi = None
+    _loadedAt = None
 
     def __init__(self, client, importantCurrencies):
 
@@ -398,7 +1670,11 @@ class Calendar:
                                   }
 
     def get_important_calendar_events_dict(self, client):
-        calendarFromApi = client.commandExecute('getCalendar')
+        if Calendar._loadedAt == None or time.monotonic() - Calendar._loadedAt > CALENDAR_TTL:
+            Calendar._calendarFromApi = client.commandExecute('getCalendar')
+            Calendar._loadedAt = time.monotonic()
+        # the events are changed below
+        calendarFromApi = deepcopy(Calendar._calendarFromApi)
 
         with open("countriesCurrencies.json", "r", encoding="UTF-8-sig") as countriesCurrencies:
             countriesCurrencies = json.load(countriesCurrencies)
@@ -714,13 +1990,95 @@ class BullsAndBears:
         return uniqueCurrencies
 
 
+# one raw bar as stored by CandleArchive, prices in the getChartRangeRequest format
+CANDLE_RECORD = np.dtype([("ctm", "<i8"), ("open", "<f8"), ("high", "<f8"),
+                          ("low", "<f8"), ("close", "<f8"), ("vol", "<f8")])
+
+
+class Candles(object):
+    # read-only columns of one chart - prices as float64, ctm as epoch ms, weekday of ctm in local time (0 is monday),
+    # weekBack numbers the weeks from the newest bar, walking back a week ends with its sunday bars
+    __slots__ = ("ctm", "open", "high", "low", "close", "vol", "weekday", "weekBack")
+
+    def __init__(self, ctm, openPrices, high, low, close, vol, weekday):
+        sundays = (weekday[::-1] == 6).astype(np.int32)
+        weekBack = (np.cumsum(sundays) - sundays)[::-1].copy()
+        for name, column in zip(Candles.__slots__, (ctm, openPrices, high, low, close, vol, weekday, weekBack)):
+            column.flags.writeable = False
+            object.__setattr__(self, name, column)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Candles are read-only")
+
+    def __len__(self):
+        return len(self.ctm)
+
+    @staticmethod
+    def from_rate_infos(rateInfos, digits):
+        # raw getChartRangeRequest bars - open in points, high/low/close relative to open
+        return Candles.from_records(Candles.records(rateInfos), digits)
+
+    @staticmethod
+    def from_records(records, digits):
+        ctm = np.array(records["ctm"], dtype=np.int64)
+        openPoints = records["open"]
+        scale = 10 ** digits
+        return Candles(ctm,
+                       openPoints / scale,
+                       (openPoints + records["high"]) / scale,
+                       (openPoints + records["low"]) / scale,
+                       (openPoints + records["close"]) / scale,
+                       np.array(records["vol"], dtype=np.float64),
+                       Candles.local_weekdays(ctm))
+
+    @staticmethod
+    def records(rateInfos):
+        return np.array([(bar["ctm"], bar["open"], bar["high"], bar["low"], bar["close"], bar.get("vol", 0.0))
+                         for bar in rateInfos
+                         ], dtype=CANDLE_RECORD)
+
+    @staticmethod
+    def local_weekdays(ctm):
+        # UTC offset looked up once per hour, 1970-01-01 was a thursday
+        hours, hourIndex = np.unique(ctm // 3600000, return_inverse=True)
+        offsets = np.array([time.localtime(hour * 3600).tm_gmtoff * 1000
+                            for hour in hours.tolist()
+                            ], dtype=np.int64)
+        localDays = (ctm + offsets[hourIndex].reshape(-1)) // 86400000
+        return ((localDays + 3) % 7).astype(np.int8)
+
+
 class Chart:
 
-    def __init__(self, client, pair, timeFrame, startTime=None):
-        timeFrames = {"day": 1440, "fourhour": 240,
-                      "hour": 60, "halfhour": 30, "quater": 15}
-        chosenTimeFrame = timeFrames[timeFrame]
+    timeFrames = {"day": 1440, "fourhour": 240,
+                  "hour": 60, "halfhour": 30, "quater": 15, "minute": 1}
+
+    def __init__(self, client, pair, timeFrame, startTime=None, rateInfos=None, digits=None):
+
+        if rateInfos == None:
+            period = Chart.timeFrames[timeFrame]
+            start = Chart.start_timestamp(startTime)
+            if CHART_BASE_PERIOD != None and period >= CHART_BASE_PERIOD and period % CHART_BASE_PERIOD == 0:
+                # every time frame asks base bars from the same aligned day start, so they are downloaded once
+                rateInfos = candleStore.rate_infos(client, pair, CHART_BASE_PERIOD,
+                                                   candleResampler.bucket_start(start, 1440))
+                if period > CHART_BASE_PERIOD:
+                    rateInfos = candleResampler.resample(rateInfos, period)
+                    start = candleResampler.bucket_start(start, period)
+                rateInfos = [bar
+                             for bar in rateInfos
+                             if bar["ctm"] >= start
+                             ]
+            else:
+                rateInfos = candleStore.rate_infos(client, pair, period, start)
+
+        if digits == None:
+            digits = symbolCache.precision(client, pair)
 
+        self.chartReady = Candles.from_rate_infos(rateInfos, digits)
+
+    @staticmethod
+    def start_timestamp(startTime=None):
         if startTime == None:
             timeDiff = timedelta(days=19)
             startTimeChart = str(
@@ -728,168 +2086,600 @@ class Chart:
         else:
             startTimeChart = startTime
 
-        endTimeChart = str(datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-
-        # daty start/koniec w formacie timestamp
-        startDateTimestampChart = int(datetime.timestamp(
+        return int(datetime.timestamp(
             datetime.strptime(startTimeChart, '%Y-%m-%d %H:%M:%S')))*1000
-        endDateTimestampChart = int(datetime.timestamp(
+
+    @staticmethod
+    def end_timestamp():
+        endTimeChart = str(datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        return int(datetime.timestamp(
             datetime.strptime(endTimeChart, '%Y-%m-%d %H:%M:%S')))*1000
 
+    @staticmethod
+    def range_arguments(pair, period, start, end):
         chart_info = {
-            "start": startDateTimestampChart,
-            "end": endDateTimestampChart,
-            "period": chosenTimeFrame,
+            "start": start,
+            "end": end,
+            "period": period,
             "symbol": pair,
             "ticks": 0
         }
-        argument = {
+        return {
             "info": chart_info
         }
 
-        chartListDays = client.commandExecute(
-            "getChartRangeRequest", argument)["returnData"]["rateInfos"]
+    @staticmethod
+    def chart_arguments(pair, timeFrame, startTime=None):
+        return Chart.range_arguments(pair, Chart.timeFrames[timeFrame],
+                                     Chart.start_timestamp(startTime), Chart.end_timestamp())
+
+
+class CandleArchive(object):
+    # closed raw bars on disk, one file of CANDLE_RECORD per (symbol, period), read through numpy.memmap
+    def __init__(self, path=CANDLE_ARCHIVE_PATH):
+        self.path = path
+        self._maps = {}
+        self._lock = Lock()
+
+    def _file(self, pair, period):
+        return os.path.join(self.path, "%s_%d.bin" % (pair, period))
+
+    def records(self, pair, period, start=None, end=None):
+        # zero-copy view of the archived bars with start <= ctm < end
+        fileName = self._file(pair, period)
+        size = os.path.getsize(fileName) if os.path.exists(fileName) else 0
+        # a record cut short by an interrupted append is left out
+        count = size // CANDLE_RECORD.itemsize
+        with self._lock:
+            cached = self._maps.get((pair, period))
+            if cached == None or cached[0] != count:
+                records = np.memmap(fileName, dtype=CANDLE_RECORD, mode="r", shape=(count,)) if count > 0 \
+                    else np.zeros(0, dtype=CANDLE_RECORD)
+                cached = (count, records)
+                self._maps[(pair, period)] = cached
+        records = cached[1]
+        if end != None:
+            records = records[:np.searchsorted(records["ctm"], end)]
+        if start != None:
+            records = records[np.searchsorted(records["ctm"], start):]
+        return records
+
+    def first_ctm(self, pair, period):
+        records = self.records(pair, period)
+        return int(records["ctm"][0]) if len(records) > 0 else None
+
+    def last_ctm(self, pair, period):
+        records = self.records(pair, period)
+        return int(records["ctm"][-1]) if len(records) > 0 else None
+
+    def rate_infos(self, pair, period, start=None, end=None):
+        return [{"ctm": ctm, "open": barOpen, "high": high, "low": low, "close": close, "vol": vol}
+                for ctm, barOpen, high, low, close, vol in self.records(pair, period, start, end).tolist()
+                ]
+
+    def candles(self, pair, period, digits, start=None, end=None):
+        return Candles.from_records(self.records(pair, period, start, end), digits)
+
+    def append(self, pair, period, rateInfos, closedAt=None):
+        # appends the closed bars newer than the last archived one, returns how many were written
+        # closedAt is when rateInfos were taken (in ms, now by default), bars ending later were still forming
+        lastCtm = self.last_ctm(pair, period)
+        if closedAt == None:
+            closedAt = time.time() * 1000
+        closedBefore = closedAt - period * 60000
+        newBars = [bar
+                   for bar in rateInfos
+                   if (lastCtm == None or bar["ctm"] > lastCtm) and bar["ctm"] <= closedBefore
+                   ]
+        if newBars == []:
+            return 0
+        os.makedirs(self.path, exist_ok=True)
+        with open(self._file(pair, period), "ab") as archiveFile:
+            # new records start right after the last whole one
+            size = archiveFile.seek(0, os.SEEK_END)
+            archiveFile.truncate(size - size % CANDLE_RECORD.itemsize)
+            archiveFile.write(Candles.records(newBars).tobytes())
+        return len(newBars)
+
+
+candleArchive = CandleArchive() if CANDLE_ARCHIVE_PATH != None else None
+
+
+class CandleStore(object):
+    # raw bars per (symbol, period) - after the first download only bars since the last one are requested
+    def __init__(self, keepDays=CANDLE_STORE_DAYS, archive=candleArchive, candleBook=None):
+        self.archive = archive
+        self.candleBook = candleBook
+        self._keepMs = keepDays * 24 * 3600 * 1000
+        self._bars = {}
+        self._coveredFrom = {}
+        self._requestedAt = {}
+        self._fetchedAt = {}
+        self._closedAt = {}
+        self._locks = {}
+        self._lock = Lock()
+        self.requestedBars = 0
+        self.streamedBars = 0
+        self.servedBars = 0
+
+    def _keyLock(self, key):
+        with self._lock:
+            return self._locks.setdefault(key, Lock())
+
+    def _fetch(self, client, pair, period, start):
+        # bars ending before the request was sent are complete in the response
+        self._closedAt[(pair, period)] = time.time() * 1000
+        rateInfos = client.commandExecute("getChartRangeRequest", Chart.range_arguments(
+            pair, period, start, Chart.end_timestamp()))["returnData"]["rateInfos"]
+        self._fetchedAt[(pair, period)] = time.time()
+        self.requestedBars += len(rateInfos)
+        return rateInfos
+
+    def _streamed(self, pair, period, start):
+        # bars since start built from the candle stream, None when the stream does not cover them
+        if self.candleBook == None or not self.candleBook.covers(pair, start):
+            return None
+        closedAt = self.candleBook.closed_until(pair)
+        delta = self.candleBook.rate_infos(pair, start)
+        if period > 1:
+            delta = candleResampler.resample(delta, period)
+        self._fetchedAt[(pair, period)] = time.time()
+        self._closedAt[(pair, period)] = closedAt
+        self.streamedBars += len(delta)
+        return delta
+
+    def _restore(self, pair, period, start):
+        # archived bars from start when the archive reaches back that far, the newer ones are requested next
+        firstCtm = self.archive.first_ctm(pair, period)
+        if firstCtm == None or firstCtm > start:
+            return None
+        self._coveredFrom[(pair, period)] = min(
+            start, self.archive.last_ctm(pair, period))
+        self._fetchedAt[(pair, period)] = 0
+        self._closedAt[(pair, period)] = 0
+        return self.archive.rate_infos(pair, period, self._coveredFrom[(pair, period)])
+
+    def _older(self, pair, period, start):
+        # archived bars from start until the stored ones, None when the archive does not hold all of them
+        key = (pair, period)
+        firstCtm = self.archive.first_ctm(pair, period)
+        if firstCtm == None or firstCtm > start or self.archive.last_ctm(pair, period) < self._coveredFrom[key]:
+            return None
+        return self.archive.rate_infos(pair, period, start, self._coveredFrom[key])
+
+    def rate_infos(self, client, pair, period, start, maxAge=CANDLE_STORE_MAX_AGE):
+        # stored bars from start until now, the last one still forming - callers must not modify them
+        key = (pair, period)
+        with self._keyLock(key):
+            bars = self._bars.get(key)
+            if bars == None and self.archive != None:
+                bars = self._restore(pair, period, start)
+            elif bars != None and self.archive != None and start < self._coveredFrom[key]:
+                older = self._older(pair, period, start)
+                if older != None:
+                    bars = older + bars
+                    self._coveredFrom[key] = start
+            if bars == None or start < self._coveredFrom[key]:
+                bars = self._fetch(client, pair, period, start)
+                self._coveredFrom[key] = start
+            elif time.time() - self._fetchedAt[key] < maxAge:
+                pass
+            elif bars == []:
+                bars = self._fetch(client, pair, period,
+                                   self._coveredFrom[key])
+            else:
+                # the stored last bar is requested again, it was still forming
+                delta = self._streamed(pair, period, bars[-1]["ctm"])
+                if delta == None:
+                    delta = self._fetch(client, pair, period, bars[-1]["ctm"])
+                if delta != []:
+                    bars = [bar
+                            for bar in bars
+                            if bar["ctm"] < delta[0]["ctm"]
+                            ] + delta
+
+            if self.archive != None:
+                # bars served from memory are only as complete as when they were taken
+                self.archive.append(pair, period, bars, self._closedAt[key])
+
+            rateInfos = [bar
+                         for bar in bars
+                         if bar["ctm"] >= start
+                         ]
+            self.servedBars += len(rateInfos)
+
+            # bars older than keepDays are kept while callers still ask for them, otherwise they are requested again
+            requestedAt = self._requestedAt.setdefault(key, {})
+            requestedAt[start] = time.monotonic()
+            for oldStart in [oldStart
+                             for oldStart, askedAt in requestedAt.items()
+                             if time.monotonic() - askedAt > CANDLE_STORE_REQUEST_TTL
+                             ]:
+                del requestedAt[oldStart]
+            cutoff = min([Chart.end_timestamp() - self._keepMs] + list(requestedAt))
+            if self._coveredFrom[key] < cutoff:
+                bars = [bar
+                        for bar in bars
+                        if bar["ctm"] >= cutoff
+                        ]
+                self._coveredFrom[key] = cutoff
+            self._bars[key] = bars
+            return rateInfos
+
+    def clear(self):
+        with self._lock:
+            self._bars = {}
+            self._coveredFrom = {}
+            self._requestedAt = {}
+            self._fetchedAt = {}
+            self._closedAt = {}
+
+
+candleStore = CandleStore()
+
+
+class CandleResampler(object):
+    # builds longer bars from base period raw bars, 4 hour and daily bars start at local midnight of alignmentTz
+    def __init__(self, alignmentTz=CHART_ALIGNMENT_TZ):
+        self._timeZone = ZoneInfo(alignmentTz) if alignmentTz != None else None
+        self._offsets = {}
+
+    def _offset(self, ctm):
+        # UTC offset of alignmentTz (in ms), looked up once per hour
+        if self._timeZone == None:
+            return 0
+        hour = ctm // 3600000
+        offset = self._offsets.get(hour)
+        if offset == None:
+            offset = int(datetime.fromtimestamp(hour * 3600, self._timeZone)
+                         .utcoffset().total_seconds()) * 1000
+            self._offsets[hour] = offset
+        return offset
+
+    def bucket_start(self, ctm, period):
+        periodMs = period * 60000
+        localCtm = ctm + self._offset(ctm)
+        return localCtm - localCtm % periodMs - self._offset(ctm)
+
+    def resample(self, rateInfos, period):
+        # raw bars keep the xAPI format - open in points, high/low/close relative to open
+        resampled = []
+        bucket = None
+        for bar in rateInfos:
+            barStart = self.bucket_start(bar["ctm"], period)
+            barOpen = bar["open"]
+            if bucket == None or barStart != bucket["ctm"]:
+                if bucket != None:
+                    resampled.append(self._raw(bucket))
+                bucket = {"ctm": barStart,
+                          "open": barOpen,
+                          "high": barOpen + bar["high"],
+                          "low": barOpen + bar["low"],
+                          "close": barOpen + bar["close"],
+                          "vol": bar["vol"]}
+            else:
+                bucket["high"] = max(bucket["high"], barOpen + bar["high"])
+                bucket["low"] = min(bucket["low"], barOpen + bar["low"])
+                bucket["close"] = barOpen + bar["close"]
+                bucket["vol"] += bar["vol"]
+        if bucket != None:
+            resampled.append(self._raw(bucket))
+        return resampled
 
-        numberOfDigits = {"EURUSD": 5, "USDJPY": 3, "GBPUSD": 5, "AUDUSD": 5,
-                          "USDCAD": 5, "EURJPY": 3, "EURGBP": 5, "GBPJPY": 3,
-                          "AUDJPY": 3, "AUDCAD": 5, "CADJPY": 3}
+    @staticmethod
+    def _raw(bucket):
+        bucket["high"] -= bucket["open"]
+        bucket["low"] -= bucket["open"]
+        bucket["close"] -= bucket["open"]
+        return bucket
 
-        for note in chartListDays:
-            note["high"] = (float(note["open"]) +
-                            float(note["high"])) / 10 ** numberOfDigits[pair]
-            note["low"] = (float(note["open"]) +
-                           float(note["low"])) / 10 ** numberOfDigits[pair]
-            note["close"] = (float(note["open"]) +
-                             float(note["close"])) / 10 ** numberOfDigits[pair]
-            note["open"] = float(note["open"]) / 10 ** numberOfDigits[pair]
-        time.sleep(2)
-        self.chartReady = chartListDays
 
+candleResampler = CandleResampler()
 
-class Resistance:
 
-    def __init__(self, client, pair, timeFrame, startTime=None):
-        daysOfWeek = {0: "mon", 1: "tue", 2: "wed",
-                      3: "thu", 4: "fri", 5: "sat", 6: "sun"}
-        chart = Chart(client, pair, timeFrame, startTime=startTime)
+class WeeklyLevels(object):
+    # highest and lowest closes of the last amountOfWeeks weeks of one chart, with startTime of the whole chart
+    def __init__(self, client, pair, timeFrame, startTime=None, amountOfWeeks=3, chart=None):
+        if chart == None:
+            chart = Chart(client, pair, timeFrame, startTime=startTime)
+        candles = chart.chartReady
 
         if startTime == None:
-            chartListDays = chart.chartReady
+            # only weeks closed by a sunday bar count, newest first
+            weeks = min(int(np.count_nonzero(candles.weekday == 6)), amountOfWeeks)
+            used = candles.weekBack < weeks
+            closes = candles.close[used][::-1]
+            starts = np.flatnonzero(
+                np.diff(candles.weekBack[used][::-1], prepend=-1))
+            self.resistance = np.maximum.reduceat(closes, starts).tolist() if weeks > 0 else []
+            self.support = np.minimum.reduceat(closes, starts).tolist() if weeks > 0 else []
         else:
-            chartListDays = chart.chartReady  # [:-1]
+            self.resistance = float(candles.close.max())
+            self.support = float(candles.close.min())
 
-        for note in chartListDays:
-            note["ctm"] = daysOfWeek[datetime.fromtimestamp(
-                note["ctm"] / 1000).weekday()]
 
-        amountOfWeeks = 3
-        allCloses = []
-        currentCloses = []
-        mondayNo = 0
-        if startTime == None:
-            for note in list(reversed(chartListDays)):
-                currentCloses.append(note["close"])
-                if note["ctm"] == "sun":
-                    mondayNo += 1
-                    allCloses.append(max(currentCloses))
-                    currentCloses = []
-                if mondayNo == amountOfWeeks:
-                    break
-        else:
-            for note in list(reversed(chartListDays)):
-                currentCloses.append(note["close"])
-            allCloses = max(currentCloses)
+class Resistance:
 
-        self.allCloses = allCloses
+    def __init__(self, client, pair, timeFrame, startTime=None):
+        self.allCloses = WeeklyLevels(
+            client, pair, timeFrame, startTime=startTime).resistance
 
 
 class Support:
 
     def __init__(self, client, pair, timeFrame, startTime=None):
-        daysOfWeek = {0: "mon", 1: "tue", 2: "wed",
-                      3: "thu", 4: "fri", 5: "sat", 6: "sun"}
-        chart = Chart(client, pair, timeFrame, startTime=startTime)
+        self.allCloses = WeeklyLevels(
+            client, pair, timeFrame, startTime=startTime).support
 
-        if startTime == None:
-            chartListDays = chart.chartReady
-        else:
-            chartListDays = chart.chartReady  # [:-1]
 
-        for note in chartListDays:
-            note["ctm"] = daysOfWeek[datetime.fromtimestamp(
-                note["ctm"] / 1000).weekday()]
-        amountOfWeeks = 3
-        allCloses = []
-        currentCloses = []
-        mondayNo = 0
+class StochEngine(object):
+    # slow stochastic of whole candle arrays, window extrema by van Herk/Gil-Werman in O(n) for any k
+    def __init__(self, k=25, ps=15, d=3):
+        self.k = k
+        self.ps = ps
+        self.d = d
 
-        if startTime == None:
-            for note in list(reversed(chartListDays)):
-                currentCloses.append(note["close"])
-                if note["ctm"] == "sun":
-                    mondayNo += 1
-                    allCloses.append(min(currentCloses))
-                    currentCloses = []
-                if mondayNo == amountOfWeeks:
-                    break
-        else:
-            for note in list(reversed(chartListDays)):
-                currentCloses.append(note["close"])
-            allCloses = min(currentCloses)
+    @staticmethod
+    def sliding_extreme(values, window, accumulate):
+        # extreme of values[i: i + window] for every full window, accumulate is np.minimum or np.maximum
+        count = len(values) - window + 1
+        if count <= 0:
+            return values[:0].copy()
+        blocks = -(-len(values) // window)
+        padded = np.empty(blocks * window)
+        padded[:len(values)] = values
+        padded[len(values):] = values[-1]
+        padded = padded.reshape(blocks, window)
+        prefix = accumulate.accumulate(padded, axis=1).reshape(-1)
+        suffix = accumulate.accumulate(padded[:, ::-1], axis=1)[:, ::-1].reshape(-1)
+        return accumulate(suffix[:count], prefix[window - 1: window - 1 + count])
 
-        self.allCloses = allCloses
+    @staticmethod
+    def rolling_sum(values, window):
+        full = np.full(len(values), np.nan)
+        if len(values) >= window:
+            full[window - 1:] = np.lib.stride_tricks.sliding_window_view(
+                values, window).sum(axis=1)
+        return full
+
+    def compute(self, candles):
+        # series aligned to candles (nan until defined) and the last values exactly as the loop in SlowStoch had them
+        k, ps = self.k, self.ps
+        bars = len(candles)
+        lowest = np.full(bars, np.nan)
+        highest = np.full(bars, np.nan)
+        lowest[k - 1:] = StochEngine.sliding_extreme(
+            candles.low, k, np.minimum)
+        highest[k - 1:] = StochEngine.sliding_extreme(
+            candles.high, k, np.maximum)
+
+        stochUp = 100 * (candles.close - lowest)
+        stochDown = highest - lowest
+        highLows = candles.high - candles.low
+        with np.errstate(divide="ignore", invalid="ignore"):
+            fastK = 100 * (candles.close - lowest) / stochDown
+            slowK = StochEngine.rolling_sum(stochUp, ps) / \
+                StochEngine.rolling_sum(stochDown, ps)
+        slowD = StochEngine.rolling_sum(slowK, self.d) / self.d
+        averageHighLows = StochEngine.rolling_sum(
+            highLows, k + ps - 1) / (k + ps - 1)
+
+        result = {"fastK": fastK, "slowK": slowK, "slowD": slowD,
+                  "highLows": highLows, "averageHighLows": averageHighLows}
+        if bars >= k + ps - 1:
+            # summed newest first in plain floats, like the original loop
+            lastUp = stochUp[-ps:][::-1].tolist()
+            lastDown = stochDown[-ps:][::-1].tolist()
+            lastHighLows = highLows[-(k + ps - 1):][::-1].tolist()
+            result["value"] = round(sum(lastUp) / sum(lastDown), 2)
+            result["averageHighLow"] = round(
+                sum(lastHighLows) / len(lastHighLows), 5)
+        return result
+
+
+stochEngine = StochEngine()
+
+
+class StochState(object):
+    # slow stochastic of one (pair, time frame) - closed bars are added once, the last bar is forming
+    def __init__(self, k=25, ps=15):
+        self.k = k
+        self.ps = ps
+        self.lastCtm = None
+        self.advanced = 0
+        self._closed = 0
+        # (bar number, price) of the last k - 1 closed bars, lows increasing and highs decreasing
+        self._lows = deque()
+        self._highs = deque()
+        # (stochUp, stochDown) of the windows ending at the last ps - 1 closed bars
+        self._terms = deque(maxlen=ps - 1)
+        self._highLows = deque(maxlen=k + ps - 2)
+        self._forming = None
+        self._value = None
+
+    def _extremes(self, high, low):
+        # lowest low and highest high of the last k - 1 closed bars and one more bar
+        lowest = min(self._lows[0][1], low) if self._lows else low
+        highest = max(self._highs[0][1], high) if self._highs else high
+        return lowest, highest
+
+    def close_bar(self, ctm, high, low, close):
+        if self._closed >= self.k - 1:
+            lowest, highest = self._extremes(high, low)
+            self._terms.append((100 * (close - lowest), highest - lowest))
+        while self._lows and self._lows[-1][1] >= low:
+            self._lows.pop()
+        self._lows.append((self._closed, low))
+        while self._highs and self._highs[-1][1] <= high:
+            self._highs.pop()
+        self._highs.append((self._closed, high))
+        oldest = self._closed - (self.k - 1)
+        while self._lows[0][0] <= oldest:
+            self._lows.popleft()
+        while self._highs[0][0] <= oldest:
+            self._highs.popleft()
+        self._highLows.append(high - low)
+        self._closed += 1
+        self.lastCtm = ctm
+        self.advanced += 1
+        self._value = None
+
+    def set_forming(self, ctm, high, low, close):
+        if self._forming != (ctm, high, low, close):
+            self._forming = (ctm, high, low, close)
+            self._value = None
+
+    def value(self):
+        # (stoch, average high-low) as SlowStoch reports them, None until k + ps - 2 bars have closed
+        if self._value == None and self._forming != None and len(self._terms) == self.ps - 1:
+            ctm, high, low, close = self._forming
+            lowest, highest = self._extremes(high, low)
+            stochUp = [100 * (close - lowest)] + [term[0]
+                                                  for term in reversed(self._terms)
+                                                  ]
+            stochDown = [highest - lowest] + [term[1]
+                                              for term in reversed(self._terms)
+                                              ]
+            highLows = [high - low] + list(reversed(self._highLows))
+            self._value = (round(sum(stochUp) / sum(stochDown), 2),
+                           round(sum(highLows) / len(highLows), 5))
+        return self._value
+
+
+class StochRegistry(object):
+    # StochState per (pair, time frame), fed with charts - only bars closed since the last update are added
+    def __init__(self, k=25, ps=15):
+        self.k = k
+        self.ps = ps
+        self._states = {}
+        self._values = {}
+        self._lock = Lock()
+
+    def update(self, pair, timeFrame, candles):
+        key = (pair, timeFrame)
+        with self._lock:
+            state = self._states.get(key)
+        ctm = candles.ctm
+        if len(ctm) == 0:
+            return None
+        if state != None:
+            start = int(np.searchsorted(ctm, state.lastCtm)) + 1 if state.lastCtm != None else 0
+            if state.lastCtm != None and (start > len(ctm) - 1 or ctm[start - 1] != state.lastCtm):
+                state = None
+        if state == None:
+            state = StochState(self.k, self.ps)
+            start = max(0, len(ctm) - 1 - (self.k + self.ps - 2))
+        for barCtm, high, low, close in zip(ctm[start:-1].tolist(), candles.high[start:-1].tolist(),
+                                            candles.low[start:-1].tolist(), candles.close[start:-1].tolist()):
+            state.close_bar(barCtm, high, low, close)
+        state.set_forming(int(ctm[-1]), float(candles.high[-1]),
+                          float(candles.low[-1]), float(candles.close[-1]))
+        value = state.value()
+        with self._lock:
+            self._states[key] = state
+            if value != None:
+                self._values[key] = value
+        return value
+
+    def record(self, pair, timeFrame, value):
+        with self._lock:
+            self._values[(pair, timeFrame)] = value
+
+    def values(self, timeFrame):
+        # {pair: stoch} of the last update of every pair in timeFrame
+        with self._lock:
+            return {pair: value[0]
+                    for (pair, valueTimeFrame), value in self._values.items()
+                    if valueTimeFrame == timeFrame
+                    }
+
+
+stochRegistry = StochRegistry()
 
 
 class SlowStoch:
 
-    def __init__(self, client, possibleTradesDict, timeFrame):
+    def __init__(self, client, possibleTradesDict, timeFrame, charts=None):
 
         possibleTradesSlowStoch = {}
         self.averageHighLowsPerPair = {}
 
+        if charts == None:
+            charts = map_pairs(client, lambda pair: Chart(
+                client, pair, timeFrame), possibleTradesDict)
+        self._charts = {pair: charts[pair]
+                        for pair in possibleTradesDict
+                        }
+        self._series = None
+
         for pair in possibleTradesDict:
-            chart = Chart(client, pair, timeFrame)
-            time.sleep(1)
-            chartListDays = chart.chartReady
-
-            # slow stoch
-            k = 25  # z ilu ma dni być liczony stoch
-            ps = 15  # zwalnianie stocha
-            currentK = 0
-
-            lowsSlow = []
-            highsSlow = []
-            closeSlow = []
-            pairsHighLows = []
-
-            for note in list(reversed(chartListDays)):
-                lowsSlow.append(note["low"])
-                highsSlow.append(note["high"])
-                closeSlow.append(note["close"])
-                pairsHighLows.append(note["high"] - note["low"])
-                currentK += 1
-                if currentK == k + ps - 1:
-                    break
-            pairsHighLowsAverage = round(
-                sum(pairsHighLows) / len(pairsHighLows), 5)
-            self.averageHighLowsPerPair[pair] = pairsHighLowsAverage
+            candles = charts[pair].chartReady
+            value = stochRegistry.update(pair, timeFrame, candles)
+            if value == None:
+                # shorter history than k + ps - 1 bars
+                value = SlowStoch.short_history_stoch(candles)
+                stochRegistry.record(pair, timeFrame, value)
+            possibleTradesSlowStoch[pair], self.averageHighLowsPerPair[pair] = value
 
-            stochUp = []
-            stochDown = []
-            index = 0
-            for index in range(ps):
-                stochUp.append(
-                    100 * (closeSlow[index] - min(lowsSlow[index: index + k])))
-                stochDown.append(
-                    max(highsSlow[index: index + k]) - min(lowsSlow[index: index + k]))
+        self.possibleTradesSlowStoch = possibleTradesSlowStoch
 
-            possibleTradesSlowStoch[pair] = round(
-                sum(stochUp) / sum(stochDown), 2)
+    @property
+    def series(self):
+        # full indicator series per pair, computed on first use
+        if self._series == None:
+            self._series = {pair: stochEngine.compute(chart.chartReady)
+                            for pair, chart in self._charts.items()
+                            }
+        return self._series
 
-        self.possibleTradesSlowStoch = possibleTradesSlowStoch
+    @staticmethod
+    def short_history_stoch(candles):
+        # slow stoch
+        k = 25  # z ilu ma dni być liczony stoch
+        ps = 15  # zwalnianie stocha
+        currentK = 0
+
+        lowsSlow = []
+        highsSlow = []
+        closeSlow = []
+        pairsHighLows = []
+
+        for low, high, close in zip(reversed(candles.low.tolist()),
+                                    reversed(candles.high.tolist()),
+                                    reversed(candles.close.tolist())):
+            lowsSlow.append(low)
+            highsSlow.append(high)
+            closeSlow.append(close)
+            pairsHighLows.append(high - low)
+            currentK += 1
+            if currentK == k + ps - 1:
+                break
+        pairsHighLowsAverage = round(
+            sum(pairsHighLows) / len(pairsHighLows), 5)
+
+        stochUp = []
+        stochDown = []
+        index = 0
+        for index in range(ps):
+            stochUp.append(
+                100 * (closeSlow[index] - min(lowsSlow[index: index + k])))
+            stochDown.append(
+                max(highsSlow[index: index + k]) - min(lowsSlow[index: index + k]))
+
+        return round(sum(stochUp) / sum(stochDown), 2), pairsHighLowsAverage
 
     @staticmethod
-    def get_possible_trades_from_stoch(possibleCurrencyPairs, fourHourSS, oneHourSS, halfHourSS, quaterSS):
+    def get_possible_trades_from_stoch(possibleCurrencyPairs, fourHourSS=None, oneHourSS=None, halfHourSS=None,
+                                       quaterSS=None):
+        # missing values are the last ones computed for the time frame
+        if fourHourSS == None:
+            fourHourSS = stochRegistry.values("fourhour")
+        if oneHourSS == None:
+            oneHourSS = stochRegistry.values("hour")
+        if halfHourSS == None:
+            halfHourSS = stochRegistry.values("halfhour")
+        if quaterSS == None:
+            quaterSS = stochRegistry.values("quater")
         possibleBuysStoch = {pair: "buy"
                              for pair in possibleCurrencyPairs
                              if quaterSS[pair] <= 20 and
@@ -926,7 +2716,7 @@ class MoneyManagement:
 
 class CurrentTrades:
 
-    def __init__(self, client):
+    def __init__(self, client, openedTradesFullInfo=None):
 
         tradesDirections = {0: "buy", 1: "sell"}
 
@@ -934,8 +2724,13 @@ class CurrentTrades:
             "openedOnly": True
         }
 
-        self.openedTradesFullInfo = client.commandExecute(
-            "getTrades", arguments)["returnData"]
+        positionBook = getattr(client, "positionBook", None)
+        if openedTradesFullInfo == None and positionBook != None and positionBook.seeded:
+            openedTradesFullInfo = positionBook.trades()
+        elif openedTradesFullInfo == None:
+            openedTradesFullInfo = client.commandExecute(
+                "getTrades", arguments)["returnData"]
+        self.openedTradesFullInfo = openedTradesFullInfo
 
         self.openedTradesOnlyPairs = {trade["symbol"]: tradesDirections[trade["cmd"]]
                                       for trade in self.openedTradesFullInfo
@@ -981,10 +2776,12 @@ class CurrentTrades:
 
     def close_trades(self, client, tradesToClose):
 
+        responses = {}
         for pair in tradesToClose:
-            Trade(client, self.openedTradesOnlyPairs[pair], "close", pair,
-                  self.openedTradesVolumes[pair], self.openedTradesOpeningPrices[pair],
-                  order=self.openedTradesOrdersNo[pair])
+            responses[pair] = Trade(client, self.openedTradesOnlyPairs[pair], "close", pair,
+                                    self.openedTradesVolumes[pair], self.openedTradesOpeningPrices[pair],
+                                    order=self.openedTradesOrdersNo[pair]).response
+        return responses
 
 
 class Trade:
@@ -1050,16 +2847,14 @@ class PositionParameters:
         startTimeChart = (
             datetime.now() - timeDiff).strftime("%Y-%m-%d %H:%M:%S")
 
-        localSupportDict = {}
-        localResistanceDict = {}
-        for pair in possibleTradesWithAllOk:
-            resistance = Resistance(
-                client, pair, "quater", startTime=startTimeChart)
-            time.sleep(1)
-            support = Support(client, pair, "quater", startTime=startTimeChart)
-            time.sleep(1)
-            localResistanceDict[pair] = resistance.allCloses
-            localSupportDict[pair] = support.allCloses
+        localLevels = map_pairs(client, lambda pair: WeeklyLevels(
+            client, pair, "quater", startTime=startTimeChart), possibleTradesWithAllOk)
+        localResistanceDict = {pair: localLevels[pair].resistance
+                               for pair in localLevels
+                               }
+        localSupportDict = {pair: localLevels[pair].support
+                            for pair in localLevels
+                            }
 
         for pair in possibleTradesWithAllOk:
             if pair in possibleFullTradesCopy:
@@ -1069,10 +2864,7 @@ class PositionParameters:
             else:
                 riskRate = 0.01
 
-            if "JPY" in pair:
-                decimals = 3
-            else:
-                decimals = 5
+            decimals = symbolCache.precision(client, pair)
 
             if possibleTradesWithAllOk[pair] == "buy":
 
@@ -1137,12 +2929,11 @@ class PositionParameters:
             Trade(client, self.tradesToExecute[pair], "open", pair,
                   self.positionLots[pair], stopLoss=self.positionSL[pair],
                   takeProfit=self.positionTP[pair])
-            time.sleep(1)
 
 
 class BidAsk:
 
-    def __init__(self, client, pairList):
+    def __init__(self, client, pairList, symbolsInfo=None):
 
         self.bidPrices = {}
         self.askPrices = {}
@@ -1150,19 +2941,37 @@ class BidAsk:
         self.swapsLong = {}
         self.swapsShort = {}
 
-        for pair in pairList:
-            arguments = {
-                "symbol": pair
-            }
-            response = client.commandExecute(
-                "getSymbol", arguments)["returnData"]
+        # fresh quotes from the stream first, getSymbol for the rest - a fresh getAllSymbols snapshot
+        # would download every instrument of the account for a few pairs
+        quoteBook = getattr(client, "quoteBook", None)
+        if symbolsInfo == None and quoteBook != None:
+            missingPairs = []
+            for pair in pairList:
+                quote = quoteBook.get(pair)
+                if quote == None:
+                    missingPairs.append(pair)
+                    continue
+                symbolInfo = symbolCache.get(client, pair)
+                self.swapsLong[pair] = symbolInfo["swapLong"]
+                self.swapsShort[pair] = symbolInfo["swapShort"]
+                self.bidPrices[pair] = quote.bid
+                self.askPrices[pair] = quote.ask
+                self.spreads[pair] = quote.spread
+        else:
+            missingPairs = list(pairList)
 
+        if symbolsInfo == None:
+            symbolsInfo = map_pairs(client, lambda pair: client.commandExecute(
+                "getSymbol", {"symbol": pair})["returnData"], missingPairs)
+        responses = symbolsInfo
+
+        for pair in missingPairs:
+            response = responses[pair]
             self.swapsLong[pair] = response["swapLong"]
             self.swapsShort[pair] = response["swapShort"]
             self.bidPrices[pair] = response["bid"]
             self.askPrices[pair] = response["ask"]
             self.spreads[pair] = round(response["ask"] - response["bid"], 5)
-            time.sleep(1)
 
 
 class Trends:
@@ -1199,14 +3008,26 @@ class Trends:
                       for pair in supportDict
                       }
 
-        self.trendsDict = {}
+        self.trendsDict = Trends.get_trends(trendRanks)
+
+    @staticmethod
+    def from_ranks(trendRanks):
+        # trends of pairs already ranked, e.g. by BatchIndicators
+        trends = Trends.__new__(Trends)
+        trends.trendsDict = Trends.get_trends(trendRanks)
+        return trends
+
+    @staticmethod
+    def get_trends(trendRanks):
+        trendsDict = {}
         for pair in trendRanks:
             if trendRanks[pair] > 1:
-                self.trendsDict[pair] = "uptrend"
+                trendsDict[pair] = "uptrend"
             elif trendRanks[pair] < 1:
-                self.trendsDict[pair] = "downtrend"
+                trendsDict[pair] = "downtrend"
             else:
-                self.trendsDict[pair] = "side"
+                trendsDict[pair] = "side"
+        return trendsDict
 
     @staticmethod
     def calculate_trend_progression(firstLevel, secondLevel, highLows):
@@ -1245,17 +3066,111 @@ class Trends:
         return self.updatedPossibleTradesDict
 
 
+class BatchIndicators(object):
+    # weekly extremes and trend ranks of many pairs at once - the bars of each pair are right-aligned
+    # into (pairs x bars) matrices, so every row ends with the newest bar of its pair
+    # the stoch goes through stochRegistry like in SlowStoch, through StochEngine when no time frame is given
+    def __init__(self, charts, timeFrame=None, k=25, ps=15, amountOfWeeks=3):
+        self.pairs = list(charts)
+        self.k = k
+        self.ps = ps
+        self.amountOfWeeks = amountOfWeeks
+        candles = [charts[pair].chartReady for pair in self.pairs]
+        self._candles = candles
+        bars = max([len(chart) for chart in candles], default=0)
+
+        self.close = np.full((len(candles), bars), np.nan)
+        self.weekday = np.full((len(candles), bars), -1, dtype=np.int8)
+        self.weekBack = np.full((len(candles), bars), -1, dtype=np.int32)
+        for row, chart in enumerate(candles):
+            columns = slice(bars - len(chart), bars)
+            self.close[row, columns] = chart.close
+            self.weekday[row, columns] = chart.weekday
+            self.weekBack[row, columns] = chart.weekBack
+
+        self.possibleTradesSlowStoch, self.averageHighLowsPerPair = self._stoch(
+            timeFrame)
+        self.resistanceDict, self.supportDict = self._weekly_extremes()
+
+    def _stoch(self, timeFrame):
+        stochs = {}
+        averageHighLows = {}
+        engine = StochEngine(self.k, self.ps)
+        for pair, candles in zip(self.pairs, self._candles):
+            if timeFrame != None:
+                value = stochRegistry.update(pair, timeFrame, candles)
+            else:
+                result = engine.compute(candles)
+                value = (result["value"], result["averageHighLow"]) if "value" in result else None
+            if value == None:
+                # shorter history than k + ps - 1 bars
+                value = SlowStoch.short_history_stoch(candles)
+                if timeFrame != None:
+                    stochRegistry.record(pair, timeFrame, value)
+            stochs[pair], averageHighLows[pair] = value
+        return stochs, averageHighLows
+
+    def _weekly_extremes(self):
+        # max and min close of the last amountOfWeeks weeks, a week ends (walking back) with its sunday bars
+        closes = self.close[:, ::-1]
+        week = self.weekBack[:, ::-1]
+        weeks = np.minimum((self.weekday == 6).sum(axis=1), self.amountOfWeeks)
+        used = (week < weeks[:, None]) & ~np.isnan(closes)
+        rows = np.nonzero(used)[0]
+        highest = np.full((len(self.pairs), self.amountOfWeeks), -np.inf)
+        lowest = np.full((len(self.pairs), self.amountOfWeeks), np.inf)
+        np.maximum.at(highest, (rows, week[used]), closes[used])
+        np.minimum.at(lowest, (rows, week[used]), closes[used])
+        resistanceDict = {pair: highest[row, :weeks[row]].tolist()
+                          for row, pair in enumerate(self.pairs)
+                          }
+        supportDict = {pair: lowest[row, :weeks[row]].tolist()
+                       for row, pair in enumerate(self.pairs)
+                       }
+        return resistanceDict, supportDict
+
+    @staticmethod
+    def trend_progressions(firstLevels, secondLevels, highLows):
+        # Trends.calculate_trend_progression for whole arrays, levels it leaves undecided count as 0
+        difference = firstLevels - secondLevels
+        return np.where((difference >= highLows) & (difference > 0), 1,
+                        np.where(np.fabs(difference) < highLows, 0,
+                                 np.where((-difference >= highLows) & (-difference > 0), -1, 0)))
+
+    def trend_ranks(self, highLows=None):
+        if highLows == None:
+            highLows = self.averageHighLowsPerPair
+        resistance = np.full((len(self.pairs), 3), np.nan)
+        support = np.full((len(self.pairs), 3), np.nan)
+        for row, pair in enumerate(self.pairs):
+            resistance[row, :len(self.resistanceDict[pair][:3])] = self.resistanceDict[pair][:3]
+            support[row, :len(self.supportDict[pair][:3])] = self.supportDict[pair][:3]
+        ranges = np.array([highLows[pair] for pair in self.pairs])
+        # the second support direction is taken from resistances, as in Trends
+        ranks = BatchIndicators.trend_progressions(resistance[:, 0], resistance[:, 1], ranges) + \
+            BatchIndicators.trend_progressions(support[:, 0], support[:, 1], ranges) + \
+            2 * BatchIndicators.trend_progressions(resistance[:, 0], resistance[:, 2], ranges)
+        return dict(zip(self.pairs, ranks.tolist()))
+
+
 class FreeCurrencyConverter:
+    # the NBP table is downloaded again only after NBP_RATES_TTL
+    _exchangeRates = None
+    _loadedAt = None
 
     @staticmethod
     def get_PLN_exchange_rate(possibleTradesWithAllOk):
 
-        exchangeRatesJson = requests.get(
-            "https://api.nbp.pl/api/exchangerates/tables/A?format=json").json()[0]["rates"]
+        if FreeCurrencyConverter._loadedAt == None or \
+                time.monotonic() - FreeCurrencyConverter._loadedAt > NBP_RATES_TTL:
+            exchangeRatesJson = requests.get(
+                "https://api.nbp.pl/api/exchangerates/tables/A?format=json").json()[0]["rates"]
 
-        exchangeRates = {rate["code"]: rate["mid"]
-                         for rate in exchangeRatesJson
-                         }
+            FreeCurrencyConverter._exchangeRates = {rate["code"]: rate["mid"]
+                                                    for rate in exchangeRatesJson
+                                                    }
+            FreeCurrencyConverter._loadedAt = time.monotonic()
+        exchangeRates = FreeCurrencyConverter._exchangeRates
 
         return {pair: exchangeRates[pair[0:3]]
                 for pair in possibleTradesWithAllOk
@@ -1267,19 +3182,17 @@ class TrailingStopLoss:
     def update_stop_loss(self, client, highLows, currentTrades):
 
         # {PARA: [OPEN, CLOSE, CLOSE, CLOSE, CLOSE], PARA2: [OPEN, CLOSE, CLOSE, CLOSE, CLOSE]}
-        tradingCharts = {}
         onlyClosePricesList = []
         tradingPairsCurrentClosePrices = {}
+        tradingCharts = map_pairs(client, lambda pair: Chart(
+            client, pair, "quater",
+            startTime=str(datetime.fromtimestamp(int(str(currentTrades.openedTradesOpenTimes[pair])[0:-3])))).chartReady,
+            currentTrades.openedTradesOpenTimes)
         for pair in currentTrades.openedTradesOpenTimes:
-            tradingCharts[pair] = Chart(
-                client, pair, "quater",
-                startTime=str(datetime.fromtimestamp(int(str(currentTrades.openedTradesOpenTimes[pair])[0:-3])))).chartReady
-
             onlyClosePricesList.append(
                 currentTrades.openedTradesOpeningPrices[pair])
 
-            for chartEntry in tradingCharts[pair]:
-                onlyClosePricesList.append(chartEntry["close"])
+            onlyClosePricesList.extend(tradingCharts[pair].close.tolist())
             tradingPairsCurrentClosePrices[pair] = onlyClosePricesList
             onlyClosePricesList = []
 
@@ -1405,7 +3318,6 @@ class TrailingStopLoss:
                         currentTrades.openedTradesVolumes[pair], price=currentTrades.openedTradesOpeningPrices[pair],
                         stopLoss=stopLossToUpdate[pair], takeProfit=currentTrades.openedTradesTakeProfit[pair],
                         order=currentTrades.openedTradesOrdersNo[pair]))
-            time.sleep(1)
 
     @staticmethod
     def get_last_chart_reversal_index(listName):
@@ -1444,3 +3356,121 @@ class TrailingStopLoss:
                     break
 
         return lastReversals
+
+
+class Indicator(object):
+    # node of IndicatorGraph - function(client, pairs, *inputs) gets the results of the named inputs,
+    # with timeFrame the charts of all pairs come first, fetched with at least lookback days of history
+    def __init__(self, name, function, inputs=(), timeFrame=None, lookback=None):
+        self.name = name
+        self.function = function
+        self.inputs = list(inputs)
+        self.timeFrame = timeFrame
+        self.lookback = lookback
+        if timeFrame != None:
+            self.inputs.insert(0, IndicatorGraph.chart_name(timeFrame))
+
+
+class IndicatorGraph(object):
+    # indicators evaluated on demand, each once per cycle - nodes whose inputs are ready run in parallel
+    def __init__(self, workers=API_POOL_SIZE):
+        self._nodes = {}
+        self._lookbacks = {}
+        self._results = {}
+        self._client = None
+        self._pairs = []
+        self._lock = Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    @staticmethod
+    def chart_name(timeFrame):
+        return "chart:" + timeFrame
+
+    def add(self, name, function, inputs=(), timeFrame=None, lookback=None):
+        indicator = Indicator(name, function, inputs, timeFrame, lookback)
+        if timeFrame != None:
+            # one chart per time frame, long enough for every indicator reading it
+            chartName = IndicatorGraph.chart_name(timeFrame)
+            lookbacks = self._lookbacks.setdefault(chartName, [])
+            lookbacks.append(lookback if lookback != None else INDICATOR_LOOKBACK_DAYS)
+            self._nodes[chartName] = Indicator(chartName, self._chart_function(timeFrame, chartName))
+        self._nodes[name] = indicator
+        return indicator
+
+    def _chart_function(self, timeFrame, chartName):
+        def charts(client, pairs):
+            startTime = str(datetime.today().date() -
+                            timedelta(days=max(self._lookbacks[chartName]))) + " 00:00:00"
+            return map_pairs(client, lambda pair: Chart(client, pair, timeFrame, startTime=startTime), pairs)
+        return charts
+
+    def begin_cycle(self, client, pairs):
+        # results of the previous cycle are dropped, the next get computes them again
+        with self._lock:
+            self._client = client
+            self._pairs = list(pairs)
+            self._results = {}
+
+    def _needed(self, names):
+        needed = set()
+        stack = list(names)
+        while stack:
+            name = stack.pop()
+            if name in needed or name in self._results:
+                continue
+            if name not in self._nodes:
+                raise KeyError("Unknown indicator: %s" % name)
+            needed.add(name)
+            stack.extend(self._nodes[name].inputs)
+        return needed
+
+    def _run(self, name):
+        indicator = self._nodes[name]
+        return indicator.function(self._client, self._pairs,
+                                  *[self._results[inputName] for inputName in indicator.inputs])
+
+    def evaluate(self, names):
+        # {name: result} of names, computing the missing ones and everything they need
+        with self._lock:
+            pending = self._needed(names)
+            running = {}
+            while pending or running:
+                for name in [name for name in pending
+                             if all(inputName in self._results for inputName in self._nodes[name].inputs)]:
+                    pending.discard(name)
+                    running[self._executor.submit(self._run, name)] = name
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    self._results[running.pop(future)] = future.result()
+            return {name: self._results[name] for name in names}
+
+    def get(self, name):
+        return self.evaluate([name])[name]
+
+
+def default_indicators():
+    # indicators used by tradingMain.py
+    graph = IndicatorGraph()
+    for timeFrame in ("quater", "halfhour", "hour"):
+        graph.add("stoch:" + timeFrame,
+                  lambda client, pairs, charts, timeFrame=timeFrame: SlowStoch(
+                      client, pairs, timeFrame, charts=charts),
+                  timeFrame=timeFrame, lookback=INDICATOR_LOOKBACK_DAYS)
+    graph.add("stoch:fourhour", lambda client, pairs, charts: BatchIndicators(charts, "fourhour"),
+              timeFrame="fourhour", lookback=INDICATOR_LOOKBACK_DAYS)
+    graph.add("resistance", lambda client, pairs, batch: batch.resistanceDict,
+              inputs=["stoch:fourhour"])
+    graph.add("support", lambda client, pairs, batch: batch.supportDict,
+              inputs=["stoch:fourhour"])
+    graph.add("trends", lambda client, pairs, batch: Trends.from_ranks(batch.trend_ranks()),
+              inputs=["stoch:fourhour"])
+    graph.add("stochTrades", lambda client, pairs, fourHour, oneHour, halfHour, quater:
+              SlowStoch.get_possible_trades_from_stoch(pairs, fourHour.possibleTradesSlowStoch,
+                                                       oneHour.possibleTradesSlowStoch,
+                                                       halfHour.possibleTradesSlowStoch,
+                                                       quater.possibleTradesSlowStoch),
+              inputs=["stoch:fourhour", "stoch:hour", "stoch:halfhour", "stoch:quater"])
+    return graph
+
+
+indicatorGraph = default_indicators()
@@ -31,6 +31,9 @@ importantCurrencies = ["EUR", "USD", "GBP", "AUD", "JPY", "CAD"]
 message = []
 fileName = 0
 iteration = 0
+reportedAt = None
+session = None
+watchdog = None
 
 
 while True:
@@ -44,6 +47,12 @@ while True:
         today = daysOfWeek[datetime.today().weekday()]
         if today == "sat" or today == "sun":
             print("czekam...")
+            if session != None:
+                candleStore.candleBook = None
+                session.disconnect()
+                session = None
+                watchdog.disconnect()
+                watchdog = None
             time.sleep(21600)
             continue
         else:
@@ -52,16 +61,32 @@ while True:
             logging.basicConfig(format=FORMAT, level=logging.DEBUG,
                                 filename='error_logs.log')
 
-            client = APIClient()
-
-            loginResponse = client.execute(
-                loginCommand(userId=userId, password=password))
-
-            if(loginResponse['status'] == False):
-                print('Login failed. Error code: {0}'.format(
-                    loginResponse['errorCode']))
-
-            ssid = loginResponse['streamSessionId']
+            # jedno zalogowane połączenie na cały tydzień
+            # session i watchdog są zapisywane dopiero gdy wszystko się uda, inaczej zamykane
+            if session == None:
+                newSession = APIClientPool(userId, password)
+                watchdogSession = None
+                try:
+                    newSession.start_streaming(possibleCurrencyPairs)
+                    # osobne połączenie, żeby zamknięcie nie czekało na pulę
+                    watchdogSession = APISession(userId, password)
+                    newWatchdog = StopLossWatchdog(watchdogSession,
+                                                   newSession.positionBook, newSession.quoteBook)
+                except:
+                    if watchdogSession != None:
+                        watchdogSession.disconnect()
+                    newSession.disconnect()
+                    raise
+                session = newSession
+                watchdog = newWatchdog
+                # świeże świece ze streamu zamiast dociągania ich z API
+                candleStore.candleBook = session.candleBook
+            client = session
+            # odpowiedzi i wskaźniki z poprzedniej pętli nie są używane ponownie
+            client.begin_cycle()
+            indicatorGraph.begin_cycle(client, possibleCurrencyPairs)
+
+            ssid = session.streamSessionId
 
             endTime = datetime.now().strftime("%H")
 
@@ -90,7 +115,6 @@ while True:
                 """
 
                 # sprawdzenie czy ceny nie ominęły stoplossów i takeprofitów
-                time.sleep(1)
                 bidAsk = BidAsk(client, list(
                     currentTrades.openedTradesOnlyPairs.keys()))
                 for pair in currentTrades.openedTradesOnlyPairs:
@@ -122,10 +146,8 @@ while True:
                 """ AKTUALIZOWANIE STOPLOSSA DLA AKTUALNYCH TREJDÓW
                 """
 
-                slowStochQuater = SlowStoch(
-                    client, possibleCurrencyPairs, "quater")
+                slowStochQuater = indicatorGraph.get("stoch:quater")
                 print("slowStochQuater", slowStochQuater.possibleTradesSlowStoch)
-                time.sleep(1)
 
                 trailingStoploss = TrailingStopLoss()
 
@@ -168,16 +190,13 @@ while True:
                 """  WSPARCIA I OPORY
                 """
 
+                # obliczenie wszystkich pozostałych wskaźników naraz, niezależne liczone równolegle
+                indicators = indicatorGraph.evaluate(["resistance", "support", "stoch:fourhour", "stoch:hour",
+                                                      "stoch:halfhour", "stochTrades", "trends"])
+
                 # obliczenie oporów i wsparć dla WSZYSTKICH możliwych trejdów
-                supportDict = {}
-                resistanceDict = {}
-                for pair in possibleCurrencyPairs:
-                    resistance = Resistance(client, pair, "fourhour")
-                    time.sleep(1)
-                    support = Support(client, pair, "fourhour")
-                    time.sleep(1)
-                    resistanceDict[pair] = resistance.allCloses
-                    supportDict[pair] = support.allCloses
+                resistanceDict = indicators["resistance"]
+                supportDict = indicators["support"]
 
                 print("supportDict", supportDict)
                 print("resistanceDict", resistanceDict)
@@ -186,34 +205,23 @@ while True:
                 """
 
                 # obliczenie slow stoch dla możliwych trejdów
-                slowStochFourHour = SlowStoch(
-                    client, possibleCurrencyPairs, "fourhour")
+                slowStochFourHour = indicators["stoch:fourhour"]
                 print("slowStochFourHour",
                       slowStochFourHour.possibleTradesSlowStoch)
-                time.sleep(1)
-                slowStochOneHour = SlowStoch(
-                    client, possibleCurrencyPairs, "hour")
+                slowStochOneHour = indicators["stoch:hour"]
                 print("slowStochOneHour", slowStochOneHour.possibleTradesSlowStoch)
-                time.sleep(1)
-                slowStochHalfHour = SlowStoch(
-                    client, possibleCurrencyPairs, "halfhour")
+                slowStochHalfHour = indicators["stoch:halfhour"]
                 print("slowStochHalfHour",
                       slowStochHalfHour.possibleTradesSlowStoch)
-                time.sleep(1)
 
                 # możliwe sell i buy z slowstocha
-                possibleTradesFromStoch = SlowStoch.get_possible_trades_from_stoch(possibleCurrencyPairs,
-                                                                                   slowStochFourHour.possibleTradesSlowStoch,
-                                                                                   slowStochOneHour.possibleTradesSlowStoch,
-                                                                                   slowStochHalfHour.possibleTradesSlowStoch,
-                                                                                   slowStochQuater.possibleTradesSlowStoch)
+                possibleTradesFromStoch = indicators["stochTrades"]
                 print("possibleTradesFromStoch", possibleTradesFromStoch)
                 """  TRENDY NA PODSTAWIE WSPARĆ I OPORÓW Z 3 TYG. I ŚR. HIGHLOWS
                 """
 
                 # określenie obecnych trendów
-                trends = Trends(resistanceDict, supportDict,
-                                slowStochFourHour.averageHighLowsPerPair)
+                trends = indicators["trends"]
                 currentTrends = trends.trendsDict
                 print("currentTrends", currentTrends)
 
@@ -240,7 +248,6 @@ while True:
                 """
 
                 # ponowne pobranie obecnych transakcji
-                time.sleep(1)
                 currentTrades = CurrentTrades(client)
 
                 # sprawdzenie możliwych trejdów z trendów i stocha z obecnymi trejdami i usunięcie ich
@@ -283,13 +290,14 @@ while True:
                 endTime = datetime.now().strftime("%H")
                 iteration += 1
 
-                if startTime != endTime or iteration % 8 == 0:
+                # raport co REPORT_INTERVAL, a nie co pętlę
+                if reportedAt == None or time.monotonic() - reportedAt >= REPORT_INTERVAL:
                     hourChange = 1
                 else:
                     hourChange = 0
-                hourChange = 1
                 if hourChange == 1:
                     iteration = 0
+                    reportedAt = time.monotonic()
                     endCounter = time.perf_counter()
                     loopTime = str(math.floor(
                         (endCounter - startCounter) / 60)) + ":" + str(round((endCounter - startCounter) % 60))
@@ -318,11 +326,20 @@ while True:
                         "Slow stoch onehour: " + str(slowStochOneHour.possibleTradesSlowStoch) + "\n \n" + \
                         "Slow stoch fourhour: " + str(slowStochFourHour.possibleTradesSlowStoch) + "\n \n" + \
                         "Resistance: " + str(resistanceDict) + "\n \n" + \
-                        "Support: " + str(supportDict)
+                        "Support: " + str(supportDict) + "\n \n" + \
+                        "pool: " + str(client.utilisation()) + "\n" + \
+                        "watchdog: " + str(watchdog.latency_summary()) + "\n" + \
+                        "stream: " + str(client.stream_stats()) + "\n" + \
+                        "cache: " + str(client.coalescer.stats()) + "\n \n" + \
+                        "api: \n" + apiStats.report()
+                    client.reset_utilisation()
+                    apiStats.reset()
                 else:
                     message = []
 
-                client.disconnect()
+                # pętla trwa co najmniej LOOP_MIN_INTERVAL, stoplossy w międzyczasie pilnuje watchdog
+                time.sleep(max(0, LOOP_MIN_INTERVAL -
+                               (time.perf_counter() - startCounter)))
                 continue
 
     except:
@@ -0,0 +1,473 @@
+import json
+import math
+import random
+import socket
+import socketserver
+import ssl
+import time
+import argparse
+from threading import Thread, Lock, Event
+
+# default ports, the same as xapi.xtb.com
+MOCK_XAPI_PORT = 5124
+MOCK_XAPI_STREAMING_PORT = 5125
+
+# xAPI message terminator
+MESSAGE_END = b'\n\n'
+
+# symbols served when none are given: symbol -> (price, precision, currency, profit currency)
+MOCK_SYMBOLS = {"EURUSD": (1.1000, 5, "EUR", "USD"), "USDJPY": (105.00, 3, "USD", "JPY"),
+                "GBPUSD": (1.3000, 5, "GBP", "USD"), "AUDUSD": (0.7200, 5, "AUD", "USD"),
+                "USDCAD": (1.3100, 5, "USD", "CAD"), "EURJPY": (123.50, 3, "EUR", "JPY"),
+                "EURGBP": (0.9000, 5, "EUR", "GBP"), "GBPJPY": (137.00, 3, "GBP", "JPY"),
+                "AUDJPY": (75.60, 3, "AUD", "JPY"), "AUDCAD": (0.9400, 5, "AUD", "CAD"),
+                "CADJPY": (80.10, 3, "CAD", "JPY")}
+
+# calendar events served by getCalendar: (country, title)
+MOCK_EVENTS = [("US", "Weekly Jobless Claims"), ("EU", "CPI M/M"), ("GB", "Retail Sales M/M"),
+               ("JP", "Industrial Production Y/Y"), ("AU", "Services PMI"),
+               ("CA", "GDP (Annualized)"), ("US", "ISM Non-Manufacturing Index")]
+
+
+class MockMarket:
+    # deterministic prices: the same symbol and minute always give the same mid price
+    def __init__(self, symbols=None, seed=0):
+        if symbols == None:
+            symbols = MOCK_SYMBOLS
+        self.symbols = symbols
+        self.seed = seed
+
+    def mid(self, symbol, timestampMs):
+        basePrice = self.symbols[symbol][0]
+        minute = int(timestampMs // 60000)
+        noise = random.Random("%s:%s:%s" % (
+            self.seed, symbol, minute)).uniform(-1, 1)
+        return basePrice * (1 + 0.010 * math.sin(minute / 2900.0) +
+                            0.003 * math.sin(minute / 170.0) + 0.0004 * noise)
+
+    def spread(self, symbol):
+        return 1.5 / 10 ** (self.symbols[symbol][1] - 1)
+
+    def bid_ask(self, symbol, timestampMs):
+        mid = self.mid(symbol, timestampMs)
+        digits = self.symbols[symbol][1]
+        halfSpread = self.spread(symbol) / 2
+        return round(mid - halfSpread, digits), round(mid + halfSpread, digits)
+
+    def rate_infos(self, symbol, period, start, end):
+        # bars in getChartRangeRequest format - open in points, the rest relative to open
+        digits = self.symbols[symbol][1]
+        periodMs = period * 60000
+        rateInfos = []
+        ctm = start - start % periodMs
+        while ctm <= end:
+            prices = [round(self.mid(symbol, ctm + minute * 60000) * 10 ** digits)
+                      for minute in range(period)
+                      ]
+            rateInfos.append({"ctm": ctm,
+                              "ctmString": time.strftime("%b %d, %Y, %I:%M:%S %p", time.gmtime(ctm / 1000)),
+                              "open": prices[0],
+                              "high": max(prices) - prices[0],
+                              "low": min(prices) - prices[0],
+                              "close": prices[-1] - prices[0],
+                              "vol": float(len(prices))})
+            ctm += periodMs
+        return rateInfos
+
+    def symbol_record(self, symbol, timestampMs):
+        price, digits, currency, currencyProfit = self.symbols[symbol]
+        bid, ask = self.bid_ask(symbol, timestampMs)
+        return {"symbol": symbol, "description": symbol, "categoryName": "FX",
+                "currency": currency, "currencyProfit": currencyProfit, "currencyPair": True,
+                "precision": digits, "bid": bid, "ask": ask, "high": ask, "low": bid,
+                "spreadRaw": round(ask - bid, digits), "spreadTable": round((ask - bid) * 10 ** (digits - 1), 1),
+                "contractSize": 100000, "lotMin": 0.01, "lotMax": 100.0, "lotStep": 0.01,
+                "swapLong": -0.5, "swapShort": 0.1, "swapType": 1, "pipsPrecision": digits - 1,
+                "tickSize": 1.0 / 10 ** digits, "tickValue": 1.0, "time": timestampMs, "type": 1}
+
+
+class MockBroker:
+    # account, positions and stream subscribers shared by both servers
+    def __init__(self, market, balance=10000.0):
+        self.market = market
+        self.balance = balance
+        self.positions = {}
+        self.lock = Lock()
+        self.nextOrder = 1000
+        self.streams = []
+        self.streamSessionId = "mock-stream-session"
+
+    def now(self):
+        return int(time.time() * 1000)
+
+    def profit(self, position):
+        bid, ask = self.market.bid_ask(position["symbol"], self.now())
+        if position["cmd"] == 0:
+            change = bid - position["open_price"]
+        else:
+            change = position["open_price"] - ask
+        return round(change * 100000 * position["volume"], 2)
+
+    def trades(self):
+        with self.lock:
+            positions = [dict(position)
+                         for position in self.positions.values()
+                         ]
+        for position in positions:
+            position["profit"] = self.profit(position)
+        return positions
+
+    def margin_level(self):
+        profit = sum(position["profit"]
+                     for position in self.trades()
+                     )
+        margin = sum(position["volume"] * 100000 / 30
+                     for position in self.positions.values()
+                     )
+        equity = round(self.balance + profit, 2)
+        return {"balance": self.balance, "credit": 0.0, "currency": "PLN", "equity": equity,
+                "margin": round(margin, 2), "margin_free": round(equity - margin, 2),
+                "margin_level": round(equity / margin * 100, 2) if margin > 0 else 0.0}
+
+    def trade_transaction(self, info):
+        symbol = info["symbol"]
+        bid, ask = self.market.bid_ask(symbol, self.now())
+        with self.lock:
+            self.nextOrder += 1
+            order = self.nextOrder
+            if info["type"] == 0:
+                position = {"symbol": symbol, "cmd": info["cmd"], "order": order, "order2": order,
+                            "position": order, "volume": info["volume"],
+                            "open_price": ask if info["cmd"] == 0 else bid,
+                            "open_time": self.now(), "sl": info.get("sl") or 0.0,
+                            "tp": info.get("tp") or 0.0, "profit": 0.0, "closed": False,
+                            "close_price": None, "close_time": None, "comment": "",
+                            "customComment": info.get("customComment"), "commission": 0.0,
+                            "digits": self.market.symbols[symbol][1], "expiration": None,
+                            "margin_rate": 0.0, "offset": 0, "storage": 0.0}
+                self.positions[order] = position
+                update = dict(position, type=0, state="Modified")
+            elif info["type"] == 2:
+                position = self.positions.pop(info["order"], None)
+                if position == None:
+                    return None
+                closePrice = bid if position["cmd"] == 0 else ask
+                self.balance += self.profit(dict(position))
+                update = dict(position, type=2, state="Deleted", closed=True,
+                              close_price=closePrice, close_time=self.now())
+            elif info["type"] == 3:
+                position = self.positions.get(info["order"])
+                if position == None:
+                    return None
+                position["sl"] = info.get("sl") or 0.0
+                position["tp"] = info.get("tp") or 0.0
+                update = dict(position, type=0, state="Modified")
+            else:
+                return None
+        self.publish("getTrades", {"command": "trade", "data": update})
+        self.publish("getTradeStatus", {"command": "tradeStatus",
+                                        "data": {"customComment": info.get("customComment"), "message": None,
+                                                 "order": order, "price": update["open_price"], "requestStatus": 3}})
+        return order
+
+    def publish(self, subscription, msg, symbol=None):
+        for stream in list(self.streams):
+            stream.push(subscription, msg, symbol)
+
+
+class MockServerConfig:
+
+    def __init__(self, latency=0.0, minInterval=0.0, throttle="delay", tickInterval=0.5,
+                 responses=None):
+        # delay added to every response (in s)
+        self.latency = latency
+        # minimal gap between commands of one connection (in s) and what happens when it is broken:
+        # "delay" holds the response, "error" answers with an error, "disconnect" drops the connection
+        self.minInterval = minInterval
+        self.throttle = throttle
+        # how often subscribed ticks are pushed (in s)
+        self.tickInterval = tickInterval
+        # recorded returnData per command, used instead of synthetic data
+        if responses == None:
+            responses = {}
+        self.responses = responses
+
+
+class FramedHandler(socketserver.BaseRequestHandler):
+
+    def setup(self):
+        if self.server.sslContext != None:
+            self.request = self.server.sslContext.wrap_socket(
+                self.request, server_side=True)
+        self.buffer = bytearray()
+        self.sendLock = Lock()
+
+    def messages(self):
+        while True:
+            end = self.buffer.find(MESSAGE_END)
+            if end == -1:
+                try:
+                    chunk = self.request.recv(65536)
+                except (socket.error, ssl.SSLError):
+                    return
+                if not chunk:
+                    return
+                self.buffer += chunk
+                continue
+            frame = bytes(self.buffer[:end])
+            del self.buffer[:end + len(MESSAGE_END)]
+            if frame.strip():
+                yield json.loads(frame)
+
+    def send(self, msg):
+        with self.sendLock:
+            self.request.sendall(json.dumps(msg).encode("utf-8") + MESSAGE_END)
+
+
+class CommandHandler(FramedHandler):
+
+    def handle(self):
+        config = self.server.config
+        lastCommand = 0.0
+        for request in self.messages():
+            now = time.monotonic()
+            if now - lastCommand < config.minInterval:
+                if config.throttle == "disconnect":
+                    return
+                elif config.throttle == "error":
+                    self.reply(request, {"status": False, "errorCode": "EX009",
+                                         "errorDescr": "Request rate limit exceeded"})
+                    lastCommand = now
+                    continue
+                time.sleep(config.minInterval - (now - lastCommand))
+            lastCommand = time.monotonic()
+            if config.latency > 0:
+                time.sleep(config.latency)
+            self.reply(request, self.server.command(request))
+
+    def reply(self, request, response):
+        if "customTag" in request:
+            response["customTag"] = request["customTag"]
+        self.send(response)
+
+
+class StreamHandler(FramedHandler):
+
+    def setup(self):
+        super().setup()
+        self.subscriptions = {}
+        self.lastCandles = {}
+        self.stopped = Event()
+
+    def push(self, subscription, msg, symbol=None):
+        if subscription not in self.subscriptions:
+            return
+        if symbol != None and symbol not in self.subscriptions[subscription]:
+            return
+        try:
+            self.send(msg)
+        except (socket.error, ssl.SSLError):
+            self.stopped.set()
+
+    def pushTicks(self):
+        broker = self.server.broker
+        while not self.stopped.wait(self.server.config.tickInterval):
+            now = broker.now()
+            for symbol in list(self.subscriptions.get("getTickPrices", [])):
+                if symbol not in broker.market.symbols:
+                    continue
+                bid, ask = broker.market.bid_ask(symbol, now)
+                self.push("getTickPrices", {"command": "tickPrices",
+                                            "data": {"symbol": symbol, "bid": bid, "ask": ask, "high": ask,
+                                                     "low": bid, "bidVolume": 1000000, "askVolume": 1000000,
+                                                     "level": 0, "quoteId": 1, "spreadRaw": round(ask - bid, 6),
+                                                     "spreadTable": 1.5, "timestamp": now}}, symbol)
+            for symbol in list(self.subscriptions.get("getCandles", [])):
+                if symbol not in broker.market.symbols:
+                    continue
+                # one message per closed minute, prices as in the real candle stream
+                closedCtm = now - now % 60000 - 60000
+                if self.lastCandles.get(symbol) == closedCtm:
+                    continue
+                self.lastCandles[symbol] = closedCtm
+                bar = broker.market.rate_infos(symbol, 1, closedCtm, closedCtm)[0]
+                digits = broker.market.symbols[symbol][1]
+                self.push("getCandles", {"command": "candle",
+                                         "data": {"symbol": symbol, "ctm": bar["ctm"], "ctmString": bar["ctmString"],
+                                                  "open": round(bar["open"] / 10 ** digits, digits),
+                                                  "high": round((bar["open"] + bar["high"]) / 10 ** digits, digits),
+                                                  "low": round((bar["open"] + bar["low"]) / 10 ** digits, digits),
+                                                  "close": round((bar["open"] + bar["close"]) / 10 ** digits, digits),
+                                                  "vol": bar["vol"], "quoteId": 1}}, symbol)
+            if "getProfits" in self.subscriptions:
+                for position in broker.trades():
+                    self.push("getProfits", {"command": "profit",
+                                             "data": {"order": position["order"], "order2": position["order2"],
+                                                      "position": position["position"],
+                                                      "profit": position["profit"]}})
+            if "getKeepAlive" in self.subscriptions:
+                self.push("getKeepAlive", {"command": "keepAlive",
+                                           "data": {"timestamp": now}})
+
+    def handle(self):
+        broker = self.server.broker
+        broker.streams.append(self)
+        pusher = Thread(target=self.pushTicks, args=())
+        pusher.daemon = True
+        pusher.start()
+        try:
+            for request in self.messages():
+                command = request["command"]
+                if request.get("streamSessionId") != broker.streamSessionId:
+                    continue
+                if command.startswith("get"):
+                    symbols = self.subscriptions.setdefault(command, set())
+                    if "symbol" in request:
+                        symbols.add(request["symbol"])
+                elif command.startswith("stop"):
+                    subscription = "get" + command[len("stop"):]
+                    if "symbol" in request:
+                        self.subscriptions.get(subscription, set()).discard(
+                            request["symbol"])
+                    else:
+                        self.subscriptions.pop(subscription, None)
+        finally:
+            self.stopped.set()
+            broker.streams.remove(self)
+
+
+class MockServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, handler, broker, config, sslContext=None):
+        self.broker = broker
+        self.config = config
+        self.sslContext = sslContext
+        super().__init__(address, handler)
+
+    def command(self, request):
+        command = request["command"]
+        arguments = request.get("arguments", {})
+        broker = self.broker
+        market = broker.market
+        if command in self.config.responses:
+            return {"status": True, "returnData": self.config.responses[command]}
+        if command == "login":
+            return {"status": True, "streamSessionId": broker.streamSessionId}
+        elif command in ("ping", "logout"):
+            return {"status": True}
+        elif command == "getServerTime":
+            return {"status": True, "returnData": {"time": broker.now(), "timeString": time.ctime()}}
+        elif command == "getAllSymbols":
+            return {"status": True, "returnData": [market.symbol_record(symbol, broker.now())
+                                                   for symbol in market.symbols
+                                                   ]}
+        elif command == "getSymbol":
+            if arguments["symbol"] not in market.symbols:
+                return {"status": False, "errorCode": "BE115", "errorDescr": "Symbol does not exist"}
+            return {"status": True, "returnData": market.symbol_record(arguments["symbol"], broker.now())}
+        elif command == "getChartRangeRequest":
+            info = arguments["info"]
+            if info["symbol"] not in market.symbols:
+                return {"status": False, "errorCode": "BE115", "errorDescr": "Symbol does not exist"}
+            end = min(info["end"], broker.now())
+            return {"status": True, "returnData": {"digits": market.symbols[info["symbol"]][1],
+                                                   "rateInfos": market.rate_infos(info["symbol"], info["period"],
+                                                                                  info["start"], end)}}
+        elif command == "getTrades":
+            return {"status": True, "returnData": broker.trades()}
+        elif command == "getMarginLevel":
+            return {"status": True, "returnData": broker.margin_level()}
+        elif command == "getCalendar":
+            return {"status": True, "returnData": mock_calendar(broker.now())}
+        elif command == "tradeTransaction":
+            order = broker.trade_transaction(arguments["tradeTransInfo"])
+            if order == None:
+                return {"status": False, "errorCode": "BE9", "errorDescr": "Order not found"}
+            return {"status": True, "returnData": {"order": order}}
+        elif command == "tradeTransactionStatus":
+            # every transaction the mock answered is executed at once
+            order = arguments["order"]
+            if order > broker.nextOrder:
+                return {"status": False, "errorCode": "BE9", "errorDescr": "Order not found"}
+            return {"status": True, "returnData": {"ask": 0.0, "bid": 0.0, "customComment": None,
+                                                   "message": None, "order": order, "requestStatus": 3}}
+        return {"status": False, "errorCode": "EX007", "errorDescr": "Unknown command " + command}
+
+
+def mock_calendar(now):
+    # events every 3 hours from yesterday to tomorrow, past ones with current values
+    rng = random.Random(now // 86400000)
+    calendar = []
+    start = now - now % 3600000 - 24 * 3600000
+    for index in range(16):
+        country, title = MOCK_EVENTS[index % len(MOCK_EVENTS)]
+        eventTime = start + index * 3 * 3600000
+        forecast = round(rng.uniform(-1, 3), 1)
+        calendar.append({"country": country, "title": title, "impact": rng.choice(["2", "3"]),
+                         "period": "(" + time.strftime("%b", time.gmtime(eventTime / 1000)) + ")",
+                         "previous": str(round(forecast + rng.uniform(-0.5, 0.5), 1)),
+                         "forecast": str(forecast),
+                         "current": str(round(forecast + rng.uniform(-0.5, 0.5), 1)) if eventTime < now else "",
+                         "time": eventTime})
+    return calendar
+
+
+def start_mock_servers(host="127.0.0.1", port=MOCK_XAPI_PORT, streamPort=MOCK_XAPI_STREAMING_PORT,
+                       config=None, market=None, certFile=None, keyFile=None):
+    # starts both servers in background threads, port 0 picks free ports
+    if config == None:
+        config = MockServerConfig()
+    if market == None:
+        market = MockMarket()
+    sslContext = None
+    if certFile != None:
+        sslContext = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        sslContext.load_cert_chain(certFile, keyFile)
+    broker = MockBroker(market)
+    servers = [MockServer((host, port), CommandHandler, broker, config, sslContext),
+               MockServer((host, streamPort), StreamHandler, broker, config, sslContext)]
+    for server in servers:
+        thread = Thread(target=server.serve_forever, args=())
+        thread.daemon = True
+        thread.start()
+    return servers
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline stand-in for xapi.xtb.com")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=MOCK_XAPI_PORT)
+    parser.add_argument("--stream-port", type=int,
+                        default=MOCK_XAPI_STREAMING_PORT)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="delay of every response in seconds")
+    parser.add_argument("--min-interval", type=float, default=0.0,
+                        help="minimal gap between commands in seconds")
+    parser.add_argument("--throttle", default="delay",
+                        choices=["delay", "error", "disconnect"])
+    parser.add_argument("--tick-interval", type=float, default=0.5)
+    parser.add_argument("--responses", default=None,
+                        help="json file with recorded returnData per command")
+    parser.add_argument("--cert", default=None)
+    parser.add_argument("--key", default=None)
+    args = parser.parse_args()
+
+    responses = None
+    if args.responses != None:
+        with open(args.responses, "r", encoding="UTF-8-sig") as jsonFile:
+            responses = json.load(jsonFile)
+
+    config = MockServerConfig(args.latency, args.min_interval, args.throttle,
+                              args.tick_interval, responses)
+    servers = start_mock_servers(args.host, args.port, args.stream_port, config,
+                                 certFile=args.cert, keyFile=args.key)
+    print("mock xAPI on %s:%s, streaming on %s:%s" % (
+        args.host, servers[0].server_address[1], args.host, servers[1].server_address[1]))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        for server in servers:
+            server.shutdown()